@@ -8,7 +8,7 @@ import sys
 from pathlib import Path
 
 from snapms.atlas_tools.atlas_import import import_atlas
-from snapms.config import AtlasFilter, Parameters
+from snapms.config import GNPS_TABLE_TYPES, AtlasFilter, Parameters
 from snapms.core import create_gnps_network_annotations, network_from_mass_list
 
 # current working directory for data file paths
@@ -31,6 +31,7 @@ def main():
         output_directory,
         atlas_filter=AtlasFilter.custom,
         custom_filter="Ascomycota|Cyanobacteria",
+        use_cache=True,
     )
 
     # Load Atlas data as Pandas dataframe
@@ -39,12 +40,12 @@ def main():
 
     if parameters.file_type == "csv":
         network_from_mass_list(atlas_df, parameters)
-    elif parameters.file_type == "graphml":
+    elif parameters.file_type == "graphml" or parameters.file_type in GNPS_TABLE_TYPES:
         create_gnps_network_annotations(atlas_df, parameters)
     else:
         print(
-            "ERROR: This file type is not supported. Supported types include csv (for simple peak lists) and graphML "
-            "(for standard GNPS output)"
+            "ERROR: This file type is not supported. Supported types include csv (for simple peak lists), graphML "
+            "(for standard GNPS output) and tsv (for GNPS node tables)"
         )
         sys.exit(-1)
 
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""Table-driven adduct registry
+
+Adducts are defined in `adducts.tsv` next to this module, one row per adduct with its name, the number of
+molecules (multiplier), the mass shift of the added or lost ions, the charge and the display label. The adduct mass
+of a compound is (multiplier * exact mass + mass shift) / |charge|. Extra definitions, or overrides of existing
+ones, are read from the TSV file in the SNAPMS_ADDUCT_FILE environment variable, so new positive and negative mode
+adducts need no code changes.
+"""
+
+import csv
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from snapms.config import ADDUCT_FILE
+from snapms.exceptions import AdductNotFound
+
+DEFAULT_ADDUCT_FILE = Path(__file__).parent / "adducts.tsv"
+
+
+@dataclass(frozen=True)
+class Adduct:
+    """Class for an adduct definition"""
+
+    name: str
+    multiplier: int
+    mass_shift: float
+    charge: int
+    label: str
+
+    def mass(self, exact_mass):
+        """Adduct mass for an exact mass, or a numpy array or pandas series of them"""
+        mass = self.multiplier * exact_mass + self.mass_shift
+        if abs(self.charge) > 1:
+            return mass / abs(self.charge)
+        return mass
+
+
+def read_adduct_file(fpath: Path) -> Dict[str, Adduct]:
+    """Read adduct definitions from a TSV file with name, multiplier, mass_shift, charge and label columns"""
+    with open(fpath, encoding="utf-8", newline="") as f:
+        return {
+            row["name"]: Adduct(
+                name=row["name"],
+                multiplier=int(row["multiplier"]),
+                mass_shift=float(row["mass_shift"]),
+                charge=int(row["charge"]),
+                label=row["label"],
+            )
+            for row in csv.DictReader(f, delimiter="\t")
+        }
+
+
+@lru_cache(maxsize=None)
+def _registry(extra_file: Optional[str]) -> Dict[str, Adduct]:
+    registry = read_adduct_file(DEFAULT_ADDUCT_FILE)
+    if extra_file is not None:
+        registry.update(read_adduct_file(Path(extra_file)))
+    return registry
+
+
+def adduct_registry() -> Dict[str, Adduct]:
+    """All known adducts by name"""
+    return _registry(ADDUCT_FILE)
+
+
+def get_adduct(name: str) -> Adduct:
+    """Adduct definition for a name. Raises AdductNotFound if the name is not in the registry."""
+    try:
+        return adduct_registry()[name]
+    except KeyError:
+        raise AdductNotFound(f"Adduct {name} not recognized") from None
+
+
+def adduct_labels(adduct_list: List[str]) -> List[str]:
+    """Display label for each adduct"""
+    return [get_adduct(name).label for name in adduct_list]
+
+
+def adduct_matrix(exact_masses: np.ndarray, adduct_list: List[str]) -> np.ndarray:
+    """(n_compounds, n_adducts) float64 matrix of adduct masses, computed in a single broadcast"""
+    adducts = [get_adduct(name) for name in adduct_list]
+    multipliers = np.array([a.multiplier for a in adducts], dtype=np.float64)
+    shifts = np.array([a.mass_shift for a in adducts], dtype=np.float64)
+    charges = np.array([max(abs(a.charge), 1) for a in adducts], dtype=np.float64)
+    exact_masses = np.asarray(exact_masses, dtype=np.float64)
+    return (exact_masses[:, None] * multipliers + shifts) / charges
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""Tools to persist the processed reference database between jobs
+
+The processed dataframe is written column by column as a bundle of memory-mappable `.npy` files (see `save_arrays`)
+so that later imports skip JSON parsing, normalization, filtering and adduct computation entirely. Strings are stored
+as categoricals with fixed-width categories, so no column is ever pickled.
+Cache files are keyed on the content hash of the source file plus every parameter that changes the processed output.
+Stores built once per reference DB (fingerprints, taxon index, neighbour graph) are array bundles as well.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import astuple
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from snapms.atlas_tools.adducts import adduct_registry
+from snapms.config import ATLAS_CACHE_DIR, AtlasFilter, Parameters
+
+# Bump when the processed dataframe or the on-disk layout changes
+CACHE_VERSION = 4
+META_KEY = "__meta__"
+INDEX_KEY = "__index__"
+# Written after every array of a bundle, marking the bundle as complete
+COMPLETE_MARKER = "complete.npy"
+
+
+def cache_dir(parameters: Parameters) -> Path:
+    """Directory holding cache files for the reference DB in `parameters`"""
+    if ATLAS_CACHE_DIR is not None:
+        return Path(ATLAS_CACHE_DIR)
+    return Path(parameters.reference_db).parent / "snapms_cache"
+
+
+@lru_cache(maxsize=None)
+def _file_digest(fpath: str, mtime_ns: int, size: int) -> str:
+    # mtime and size are only part of the memoization key so edited files are re-hashed
+    digest = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hash(fpath: Path) -> str:
+    """SHA256 of the reference DB file contents. Memoized per process for unchanged files."""
+    stat = Path(fpath).stat()
+    return _file_digest(str(Path(fpath).absolute()), stat.st_mtime_ns, stat.st_size)
+
+
+def cache_key(parameters: Parameters) -> str:
+    """Key identifying the processed reference DB for a set of parameters"""
+    custom_filter = (
+        parameters.custom_filter
+        if parameters.atlas_filter == AtlasFilter.custom
+        else None
+    )
+    key_data = dict(
+        version=CACHE_VERSION,
+        source=source_hash(parameters.reference_db),
+        atlas_filter=AtlasFilter(parameters.atlas_filter).value,
+        custom_filter=custom_filter,
+        adduct_list=list(parameters.adduct_list),
+        # definitions can be overridden with SNAPMS_ADDUCT_FILE
+        adducts=[
+            astuple(adduct_registry()[a])
+            for a in parameters.adduct_list
+            if a in adduct_registry()
+        ],
+        stream_reference_db=bool(parameters.stream_reference_db),
+    )
+    encoded = json.dumps(key_data, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def atlas_cache_path(parameters: Parameters) -> Path:
+    return cache_dir(parameters) / f"atlas_{cache_key(parameters)}"
+
+
+def dataframe_to_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Convert a dataframe to a dict of numpy arrays, one per column, plus layout metadata.
+    Categorical columns are stored as their codes and categories, with string categories as a fixed-width array.
+
+    Raises ValueError for object columns, which could only be stored pickled. Convert them to categoricals first.
+    """
+    arrays = {}
+    columns = []
+    for idx, (name, series) in enumerate(df.items()):
+        # Column names may not be valid file names, so store by position
+        key = f"c{idx}"
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories.to_numpy()
+            if categories.dtype == object:
+                categories = categories.astype(str)
+            columns.append(dict(name=name, key=key, categorical=True))
+            arrays[key] = series.cat.codes.to_numpy()
+            arrays[f"{key}_categories"] = categories
+            continue
+        if series.dtype == object:
+            raise ValueError(f"Object column {name} can not be cached")
+        columns.append(dict(name=name, key=key))
+        arrays[key] = series.to_numpy()
+    arrays[INDEX_KEY] = df.index.to_numpy()
+    arrays[META_KEY] = np.array(json.dumps(dict(columns=columns)))
+    return arrays
+
+
+def arrays_to_dataframe(arrays) -> pd.DataFrame:
+    """Rebuild a dataframe written with `dataframe_to_arrays`"""
+    meta = json.loads(str(arrays[META_KEY]))
+    data = {
+        c["name"]: pd.Categorical.from_codes(
+            arrays[c["key"]], arrays[f"{c['key']}_categories"]
+        )
+        if c.get("categorical")
+        else arrays[c["key"]]
+        for c in meta["columns"]
+    }
+    return pd.DataFrame(data, index=arrays[INDEX_KEY], columns=list(data))
+
+
+def array_names(meta: np.ndarray) -> List[str]:
+    """Names of the arrays written by `dataframe_to_arrays`, from its layout metadata"""
+    names = [META_KEY, INDEX_KEY]
+    for column in json.loads(str(meta))["columns"]:
+        names.append(column["key"])
+        if column.get("categorical"):
+            names.append(f"{column['key']}_categories")
+    return names
+
+
+def load_atlas(parameters: Parameters) -> Optional[pd.DataFrame]:
+    """Load the processed reference DB from the cache. Returns None on a cache miss."""
+    directory = atlas_cache_path(parameters)
+    meta = load_arrays(directory, [META_KEY])
+    if meta is None:
+        return None
+    return arrays_to_dataframe(load_arrays(directory, array_names(meta[META_KEY])))
+
+
+def save_atlas(df: pd.DataFrame, parameters: Parameters) -> Optional[Path]:
+    """Write the processed reference DB to the cache. Returns the cache path, or None if it could not be written."""
+    return save_arrays(atlas_cache_path(parameters), dataframe_to_arrays(df))
+
+
+def write_npy(fpath: Path, array: np.ndarray) -> Optional[Path]:
+    """Atomically write a single array to a `.npy` file, which can be memory-mapped on load"""
+    return _atomic_write(fpath, lambda f: np.save(f, array))
+
+
+def save_arrays(directory: Path, arrays: Dict[str, np.ndarray]) -> Optional[Path]:
+    """Write a bundle of arrays to `directory` as `.npy` files, then the completion marker.
+    Returns the directory, or None if any file could not be written (the bundle is then never loaded).
+    """
+    for name, array in arrays.items():
+        if write_npy(directory / f"{name}.npy", array) is None:
+            return None
+    if write_npy(directory / COMPLETE_MARKER, np.array(len(arrays))) is None:
+        return None
+    return directory
+
+
+def load_arrays(
+    directory: Path, names: Iterable[str]
+) -> Optional[Dict[str, np.ndarray]]:
+    """Memory-map the arrays of a bundle written by `save_arrays`. Returns None if the bundle is not complete."""
+    if not (directory / COMPLETE_MARKER).exists():
+        return None
+    arrays = {}
+    for name in names:
+        fpath = directory / f"{name}.npy"
+        try:
+            arrays[name] = np.load(fpath, mmap_mode="r")
+        except ValueError:
+            # numpy cannot memory-map empty arrays
+            arrays[name] = np.load(fpath)
+    return arrays
+
+
+# Stores already memory-mapped by this process, by loader and arguments
+_open_stores = {}
+
+
+def open_store(load: Callable, *args):
+    """Load a store with `load(*args)` once per process. Missing stores (None) are retried on the next call."""
+    key = (load, *args)
+    if key not in _open_stores:
+        store = load(*args)
+        if store is None:
+            return None
+        _open_stores[key] = store
+    return _open_stores[key]
+
+
+def _atomic_write(fpath: Path, writer: Callable) -> Optional[Path]:
+    tmp_name = None
+    try:
+        fpath.parent.mkdir(exist_ok=True, parents=True)
+        with tempfile.NamedTemporaryFile(
+            dir=fpath.parent, prefix=".tmp_", suffix=fpath.suffix, delete=False
+        ) as f:
+            tmp_name = f.name
+            writer(f)
+        os.replace(tmp_name, fpath)
+    except OSError as e:
+        print(f"WARNING - Could not write cache file {fpath}: {e}")
+        if tmp_name is not None and Path(tmp_name).exists():
+            Path(tmp_name).unlink()
+        return None
+    return fpath
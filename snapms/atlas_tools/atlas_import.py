@@ -2,63 +2,225 @@
 
 """Tools to import and reformat NP Atlas data"""
 
+import json
+import re
 import unicodedata
-from typing import List, Optional
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 
 import numpy as np
 import pandas as pd
 
+from snapms.atlas_tools import atlas_cache
+from snapms.atlas_tools.adducts import adduct_matrix, get_adduct
+from snapms.atlas_tools.taxon_index import LabelRows, filter_labels, get_taxon_index
 from snapms.config import AtlasFilter, Parameters
-from snapms.exceptions import AdductNotFound
+from snapms.matching_tools.CompoundMatch import friendly_name
+
+# Top level reference DB fields used by SNAP-MS, with numeric fields stored as float64
+REFERENCE_FIELDS = ["npaid", "coconut_id", "original_name", "smiles"]
+REFERENCE_MASS_FIELDS = ["exact_mass", "m_plus_h", "m_plus_na"]
+# Adduct masses provided in the Atlas download
+PRECOMPUTED_ADDUCTS = ["m_plus_h", "m_plus_na"]
+# Repeated reference DB fields, stored as categoricals in the processed dataframe
+CATEGORICAL_COLUMNS = [
+    "origin_organism_type",
+    "origin_organism_genus",
+    "origin_organism_species",
+    "origin_organism_taxon_name",
+    "origin_organism_taxon_rank",
+    "origin_organism_taxon_taxon_db",
+    "origin_reference_journal",
+]
+# Columns of the processed dataframe used after import, the only ones kept in the reference DB cache along with
+# the adduct masses
+CACHED_COLUMNS = [
+    "npaid",
+    "coconut_id",
+    "exact_mass",
+    "smiles",
+    "name",
+    "display_name",
+    "origin_organism_type",
+]
+# Separators between the records of a JSON array
+_JSON_SEPARATORS = re.compile(r"[\s,]*")
 
 
 def import_atlas(parameters: Parameters):
     """Import Atlas data from Advanced search output, and reformat as a pandas df with cleaned headers and additional
     adducts (if selected)
+
+    If `parameters.use_cache` is set, the processed dataframe is loaded from (or saved to) the reference DB cache
+    and a prebuilt taxon index is used for filtering.
+    Cached dataframes only hold the columns used after import, plus the XML-safe display name of every compound
+    (see cached_schema and add_display_names).
+    If `parameters.stream_reference_db` is set, only the fields used by SNAP-MS are read (see read_reference_db)
     """
+    if parameters.use_cache:
+        cached_df = atlas_cache.load_atlas(parameters)
+        if cached_df is not None:
+            print("Finished reference database import from cache")
+            return cached_df
     # input_df = pd.read_csv(
     #     parameters.reference_db, sep="\t", header=0, encoding="utf-8"
     # )
-    input_df = normalize_dataframe(pd.read_json(parameters.reference_db))
+    if parameters.stream_reference_db:
+        input_df = read_reference_db(parameters.reference_db)
+    else:
+        input_df = normalize_dataframe(pd.read_json(parameters.reference_db))
+    taxon_index = get_taxon_index(parameters)
     input_df = apply_db_filter(
-        input_df, parameters.atlas_filter, parameters.custom_filter
+        input_df, parameters.atlas_filter, parameters.custom_filter, taxon_index
     )
     # clean_headers(input_df) # shouldn't be needed with JSON input
     input_df = clean_names(input_df)
     input_df = extend_adducts(input_df, parameters.adduct_list)
+    input_df = apply_compact_schema(input_df, parameters.adduct_list)
+    if parameters.use_cache:
+        # computed once here for every later job, uncached jobs only name their matches
+        input_df = cached_schema(add_display_names(input_df), parameters.adduct_list)
+        atlas_cache.save_atlas(input_df, parameters)
     print("Finished reference database import")
     return input_df
 
 
 def apply_db_filter(
-    df: pd.DataFrame, filter_type: AtlasFilter, custom_value: Optional[str] = None
+    df: pd.DataFrame,
+    filter_type: AtlasFilter,
+    custom_value: Optional[str] = None,
+    taxon_index: Optional[LabelRows] = None,
 ) -> pd.DataFrame:
-    """Apply filtering to NP Atlas standard dataframe POST normalization"""
+    """Apply filtering to NP Atlas standard dataframe POST normalization
+
+    If given, rows are selected through `taxon_index`, the prebuilt index for `filter_type` whose row ids are
+    positions in `df` (see taxon_index.get_taxon_index). Otherwise the taxon columns are scanned.
+    """
     if filter_type == AtlasFilter.bacteria:
         print("Filtering for bacteria")
+        if taxon_index is not None:
+            return df.take(taxon_index.rows(filter_labels(filter_type)))
         return df[df.origin_organism_type == "Bacterium"].copy()
     elif filter_type == AtlasFilter.fungi:
         print("Filtering for fungi")
+        if taxon_index is not None:
+            return df.take(taxon_index.rows(filter_labels(filter_type)))
         return df[df.origin_organism_type == "Fungus"].copy()
     elif filter_type == AtlasFilter.custom:
         assert isinstance(custom_value, str), "Custom value not valid"
         print(f"Filtering for custom {custom_value}")
-        names = map(lambda x: x.strip(), custom_value.split("|"))
-        masks = []
-        for n in names:
-            masks.append(df["origin_organism_taxon_name"] == n)
-            masks.append(
-                df["origin_organism_taxon_ancestors"].apply(
-                    lambda x: any([a["name"] == n for a in x])
+        if taxon_index is not None:
+            df1 = df.take(taxon_index.rows(filter_labels(filter_type, custom_value)))
+        else:
+            names = map(lambda x: x.strip(), custom_value.split("|"))
+            masks = []
+            for n in names:
+                masks.append(df["origin_organism_taxon_name"] == n)
+                masks.append(
+                    df["origin_organism_taxon_ancestors"].apply(
+                        lambda x: any([a["name"] == n for a in x])
+                    )
                 )
-            )
-        mask = np.array(masks).any(axis=0)
-        df1 = df[mask].copy()
+            mask = np.array(masks).any(axis=0)
+            df1 = df[mask].copy()
         print(f"Custom filtered DF has {len(df1)} compounds")
         return df1
     return df
 
 
+def iter_json_records(fpath: Path, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Stream the records of a JSON array file one at a time, reading chunk_size characters at a time"""
+    decoder = json.JSONDecoder()
+    with open(fpath, encoding="utf-8") as f:
+        buffer = ""
+        while not buffer:
+            chunk = f.read(chunk_size)
+            buffer = chunk.lstrip()
+            if not chunk:
+                break
+        if not buffer.startswith("["):
+            raise ValueError(f"{Path(fpath).name} is not a JSON array")
+        pos = 1
+        while True:
+            pos = _JSON_SEPARATORS.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the record continues past the end of the buffer
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield record
+            pos = end
+
+
+def read_reference_db(fpath: Path) -> pd.DataFrame:
+    """Stream the reference DB JSON into a dataframe holding only the fields used by SNAP-MS.
+
+    Keeps the ids, names, SMILES and masses of every compound, plus the organism type, taxon name and taxon
+    ancestor names under the column names given by normalize_dataframe. Masses are collected straight into float64
+    arrays, and fields missing from every record are left out. The index is the record position in the file.
+    """
+    fields: Dict[str, list] = {name: [] for name in REFERENCE_FIELDS}
+    masses: Dict[str, array] = {name: array("d") for name in REFERENCE_MASS_FIELDS}
+    organism_types = []
+    taxon_names = []
+    taxon_ancestors = []
+    present = set()
+    for record in iter_json_records(fpath):
+        present.update(record)
+        for name, values in fields.items():
+            values.append(record.get(name))
+        for name, values in masses.items():
+            value = record.get(name)
+            values.append(float(value) if value is not None else np.nan)
+        organism = record.get("origin_organism") or {}
+        taxon = organism.get("taxon") or {}
+        organism_types.append(organism.get("type"))
+        taxon_names.append(taxon.get("name"))
+        taxon_ancestors.append(
+            [{"name": a.get("name")} for a in taxon.get("ancestors") or []]
+        )
+    columns = {name: values for name, values in fields.items() if name in present}
+    for name, values in masses.items():
+        if name in present:
+            columns[name] = np.frombuffer(values, dtype=np.float64)
+    columns["origin_organism_type"] = organism_types
+    columns["origin_organism_taxon_name"] = taxon_names
+    columns["origin_organism_taxon_ancestors"] = taxon_ancestors
+    return pd.DataFrame(columns)
+
+
+def apply_compact_schema(df: pd.DataFrame, adduct_list: List[str]) -> pd.DataFrame:
+    """Store repeated fields (CATEGORICAL_COLUMNS) as categoricals and the exact and adduct masses as float64.
+    Unique strings such as SMILES and names are left as object columns.
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    for column in ["exact_mass", "m_plus_h", "m_plus_na", *adduct_list]:
+        if column in df:
+            df[column] = df[column].astype(np.float64)
+    return df
+
+
+def cached_schema(df: pd.DataFrame, adduct_list: List[str]) -> pd.DataFrame:
+    """Keep only CACHED_COLUMNS and the adduct masses, with the remaining string columns as categoricals so the
+    dataframe can be cached without pickling (see atlas_cache.dataframe_to_arrays)
+    """
+    columns = [c for c in dict.fromkeys([*CACHED_COLUMNS, *adduct_list]) if c in df]
+    df = df[columns].copy()
+    for column in df.select_dtypes(include="object"):
+        df[column] = df[column].astype("category")
+    return df
+
+
 def normalize_dataframe(
     df: pd.DataFrame, cols: List[str] = ["origin_reference", "origin_organism"]
 ) -> pd.DataFrame:
@@ -85,6 +247,14 @@ def clean_names(
     return df
 
 
+def add_display_names(
+    df: pd.DataFrame, name_col: str = "name", display_col: str = "display_name"
+) -> pd.DataFrame:
+    """Add the XML-safe compound name used in output networks (see CompoundMatch.friendly_name)"""
+    df[display_col] = [friendly_name(n) for n in df[name_col]]
+    return df
+
+
 def clean_headers(df: pd.DataFrame) -> pd.DataFrame:
     """Tidy up headers in dataframe containing whitespace"""
     df.columns = (
@@ -96,31 +266,34 @@ def clean_headers(df: pd.DataFrame) -> pd.DataFrame:
 
 def adduct_compute(exact_mass: pd.Series, name: str) -> pd.Series:
     """Compute the adduct mass given and pandas series.
-    To add new adducts, simply add a new `if name == 'new_adduct_name'` statement.
+    Adducts are defined in the adduct registry (see atlas_tools.adducts), new adducts are added there.
     Returns a new series.
 
     This method should also work for pure floats/ints or numpy arrays, but is not tested for them.
 
     Raises AdductNotFound if adduct name not recognized.
     """
-    if name == "m_plus_nh4":
-        return exact_mass + 18.033823
-    if name == "m_plus_h_minus_h2o":
-        return exact_mass - 17.00328
-    if name == "m_plus_k":
-        return exact_mass + 38.963158
-    if name == "2m_plus_h":
-        return (2 * exact_mass) + 1.007276
-    if name == "2m_plus_na":
-        return (2 * exact_mass) + 22.989218
-    raise AdductNotFound("Adduct not recognized")
+    return get_adduct(name).mass(exact_mass)
 
 
 def extend_adducts(atlas_df: pd.DataFrame, adduct_list: List[str]) -> pd.DataFrame:
-    """Tool to include additional adducts in Atlas dataframe, beyond m_plus_h and m_plus_na provided in Atlas download"""
-    for adduct_name in adduct_list:
+    """Tool to include additional adducts in Atlas dataframe, beyond m_plus_h and m_plus_na provided in Atlas download.
+    All adduct columns are computed as one (compounds x adducts) matrix (see atlas_adduct_matrix).
+    """
+    matrix = atlas_adduct_matrix(atlas_df, adduct_list)
+    for position, adduct_name in enumerate(adduct_list):
         # skip pre-computed values
-        if adduct_name in ["m_plus_h", "m_plus_na"]:
-            continue
-        atlas_df[adduct_name] = adduct_compute(atlas_df["exact_mass"], adduct_name)
+        if not (adduct_name in PRECOMPUTED_ADDUCTS and adduct_name in atlas_df):
+            atlas_df[adduct_name] = matrix[:, position]
     return atlas_df
+
+
+def atlas_adduct_matrix(atlas_df: pd.DataFrame, adduct_list: List[str]) -> np.ndarray:
+    """(compounds x adducts) float64 adduct mass matrix of a reference DB dataframe, computed from the exact masses
+    with the adduct registry (see adducts.adduct_matrix). Adduct masses provided in the Atlas download are used as is.
+    """
+    matrix = adduct_matrix(atlas_df["exact_mass"].to_numpy(), adduct_list)
+    for position, adduct_name in enumerate(adduct_list):
+        if adduct_name in PRECOMPUTED_ADDUCTS and adduct_name in atlas_df:
+            matrix[:, position] = atlas_df[adduct_name].to_numpy(dtype=np.float64)
+    return matrix
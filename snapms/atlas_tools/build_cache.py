@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""Offline builds of the reference database stores shared by all jobs
+
+The fingerprint store, taxon index and neighbour graph only depend on the reference DB contents, so they are built
+once per reference DB release with:
+
+    python -m snapms.atlas_tools.build_cache /path/to/NPAtlas_download.json
+
+`--stores` limits the build to some of the stores, e.g. `--stores fingerprints neighbours` for COCONUT, which has
+no taxon data. Stores are written to the same cache directory the app uses (see atlas_cache.cache_dir).
+This module is the only entry point of the builds and is never imported by the package itself.
+"""
+
+import argparse
+from pathlib import Path
+from typing import List, Optional
+
+from snapms.atlas_tools.atlas_import import read_reference_db
+from snapms.atlas_tools.fingerprint_store import build_fingerprint_store
+from snapms.atlas_tools.neighbour_graph import build_neighbour_graph
+from snapms.atlas_tools.taxon_index import build_taxon_index
+from snapms.config import Parameters
+
+# Stores in build order, the neighbour graph is computed from the fingerprint store
+STORES = ["fingerprints", "taxa", "neighbours"]
+
+
+def build_cache(reference_db: Path, stores: List[str] = STORES) -> None:
+    """Build the selected stores for the unfiltered reference DB at `reference_db`"""
+    parameters = Parameters(
+        file_path=reference_db,
+        atlas_db_path=reference_db,
+        output_path=reference_db.parent,
+        use_cache=True,
+    )
+    if "fingerprints" in stores or "taxa" in stores:
+        # row ids are positions in the reference DB file
+        atlas_df = read_reference_db(reference_db)
+        if "fingerprints" in stores:
+            build_fingerprint_store(atlas_df, parameters)
+        if "taxa" in stores:
+            build_taxon_index(atlas_df, parameters)
+    if "neighbours" in stores:
+        build_neighbour_graph(parameters)
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m snapms.atlas_tools.build_cache",
+        description="Build the reference database stores shared by all SNAP-MS jobs",
+    )
+    parser.add_argument("reference_db", type=Path, help="reference DB JSON file")
+    parser.add_argument(
+        "--stores",
+        nargs="+",
+        choices=STORES,
+        default=STORES,
+        help="stores to build (default: all)",
+    )
+    parsed = parser.parse_args(args)
+    build_cache(parsed.reference_db, parsed.stores)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Precomputed Morgan fingerprints for every compound in the reference database
+
+Fingerprints are the radius 2 count fingerprints used by create_networks, serialized with RDKit `ToBinary` and
+packed into one contiguous byte array with an offsets array. Both are `.npy` files which are memory-mapped on load.
+Entries are indexed by row id, the position of the compound in the reference DB file, which is also the index
+label of the processed Atlas dataframe. The store only depends on the reference DB contents, so every filter and
+adduct selection shares it. It is built offline, once per reference DB release, with:
+
+    python -m snapms.atlas_tools.build_cache /path/to/NPAtlas_download.json
+
+Jobs without a built store fingerprint their matched SMILES instead (see create_networks).
+"""
+
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem, DataStructs
+from rdkit.Chem import AllChem
+
+from snapms.atlas_tools import atlas_cache
+from snapms.config import Parameters
+
+
+class FingerprintStore:
+    """Class for looking up packed fingerprints by reference DB row id"""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def fingerprint(self, row_id: int) -> Optional[DataStructs.UIntSparseIntVect]:
+        """Fingerprint for a row id. None if the SMILES could not be fingerprinted at build time."""
+        start, stop = self.offsets[row_id], self.offsets[row_id + 1]
+        if start == stop:
+            return None
+        return DataStructs.UIntSparseIntVect(self.data[start:stop].tobytes())
+
+    def fingerprints(
+        self, row_ids: Sequence[int]
+    ) -> List[Optional[DataStructs.UIntSparseIntVect]]:
+        return [self.fingerprint(r) for r in row_ids]
+
+    @classmethod
+    def from_smiles(cls, smiles_list: Sequence[str]) -> "FingerprintStore":
+        """Fingerprint every SMILES, in row id order"""
+        packed = [_packed_fingerprint(smiles) for smiles in smiles_list]
+        offsets = np.zeros(len(packed) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in packed], out=offsets[1:])
+        data = np.frombuffer(b"".join(packed), dtype=np.uint8)
+        return cls(offsets, data)
+
+    def save(self, directory: Path) -> Optional[Path]:
+        """Write the store as a bundle of `.npy` files (see atlas_cache.save_arrays)"""
+        return atlas_cache.save_arrays(
+            directory, dict(offsets=self.offsets, data=self.data)
+        )
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["FingerprintStore"]:
+        """Memory-map a store written by `save`. Returns None if it does not exist."""
+        arrays = atlas_cache.load_arrays(directory, ["offsets", "data"])
+        if arrays is None:
+            return None
+        return cls(arrays["offsets"], arrays["data"])
+
+
+def _packed_fingerprint(smiles: str) -> bytes:
+    mol = Chem.MolFromSmiles(smiles) if isinstance(smiles, str) else None
+    if mol is None:
+        return b""
+    return AllChem.GetMorganFingerprint(mol, 2).ToBinary()
+
+
+def fingerprint_store_dir(parameters: Parameters) -> Path:
+    source = atlas_cache.source_hash(parameters.reference_db)
+    return atlas_cache.cache_dir(parameters) / f"fingerprints_{source[:32]}"
+
+
+def build_fingerprint_store(
+    atlas_df: pd.DataFrame, parameters: Parameters
+) -> FingerprintStore:
+    """Offline build of the fingerprint store from the unfiltered reference DB, where row ids are positions"""
+    print("Building reference database fingerprint store")
+    store = FingerprintStore.from_smiles(atlas_df["smiles"].to_list())
+    store.save(fingerprint_store_dir(parameters))
+    return store
+
+
+def get_fingerprint_store(parameters: Parameters) -> Optional[FingerprintStore]:
+    """Memory-mapped fingerprint store for the reference DB in `parameters`.
+    Returns None if caching is disabled or the store has not been built.
+    """
+    if not parameters.use_cache:
+        return None
+    return atlas_cache.open_store(
+        FingerprintStore.load, fingerprint_store_dir(parameters)
+    )
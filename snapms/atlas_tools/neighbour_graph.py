@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""Precomputed similarity neighbour graph for the whole reference database
+
+Every compound pair in the reference DB with a Dice similarity at or above the network cutoff is stored once,
+offline, as a sparse CSR matrix indexed by row id (see fingerprint_store). Jobs then take the subgraph induced by
+their matched rows instead of computing any pairwise similarity.
+
+The build is quadratic in the size of the reference DB, so it is never run inside a job. Run it once per
+reference DB release with:
+
+    python -m snapms.atlas_tools.build_cache /path/to/NPAtlas_download.json
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from snapms.atlas_tools import atlas_cache
+from snapms.atlas_tools.fingerprint_store import (
+    FingerprintStore,
+    build_fingerprint_store,
+    get_fingerprint_store,
+)
+from snapms.config import Parameters
+from snapms.network_tools.similarity_tiles import Pairs, pruned_rdkit_pairs
+
+# Lowest similarity stored in the neighbour graph, the default network cutoff
+NEIGHBOUR_CUTOFF = 0.66
+
+
+class NeighbourGraph:
+    """Class holding the sparse Atlas-wide similarity graph
+
+    matrix is a symmetric (rows x rows) CSR matrix of Dice similarities >= cutoff, including the diagonal.
+    valid marks the rows that had a fingerprint at build time.
+    """
+
+    def __init__(self, matrix: sparse.csr_matrix, valid: np.ndarray, cutoff: float):
+        self.matrix = matrix
+        self.valid = valid
+        self.cutoff = cutoff
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def covers(self, row_ids: np.ndarray, cutoff: float) -> bool:
+        """Check if all edges between row_ids at `cutoff` can be taken from this graph"""
+        if cutoff < self.cutoff:
+            return False
+        if len(row_ids) and row_ids.max() >= len(self):
+            return False
+        return bool(self.valid[row_ids].all())
+
+    def pairs(self, unique_ids: np.ndarray, cutoff: float) -> Pairs:
+        """Similarity pairs at or above `cutoff` between sorted unique row ids, as positions in unique_ids with
+        cols >= rows (see similarity_tiles.Pairs)
+        """
+        upper = sparse.triu(self.matrix[unique_ids][:, unique_ids])
+        keep = upper.data >= cutoff
+        return upper.row[keep], upper.col[keep], upper.data[keep]
+
+    @classmethod
+    def from_fingerprints(
+        cls, store: FingerprintStore, cutoff: float = NEIGHBOUR_CUTOFF
+    ) -> "NeighbourGraph":
+        """All pairs build, comparing each row against itself and all later rows"""
+        fingerprints = store.fingerprints(range(len(store)))
+        valid = np.array([fp is not None for fp in fingerprints], dtype=bool)
+        valid_ids = np.flatnonzero(valid)
+        valid_fingerprints = [fingerprints[r] for r in valid_ids]
+        positions, partners, values = pruned_rdkit_pairs(valid_fingerprints, cutoff)
+        rows = valid_ids[positions]
+        cols = valid_ids[partners]
+        upper = sparse.coo_matrix((values, (rows, cols)), shape=(len(store),) * 2)
+        # mirror the strict upper triangle to make the matrix symmetric
+        matrix = (upper + sparse.triu(upper, k=1).T).tocsr()
+        matrix.sort_indices()
+        return cls(matrix, valid, cutoff)
+
+    def save(self, directory: Path) -> Optional[Path]:
+        """Write the CSR arrays as a bundle of `.npy` files (see atlas_cache.save_arrays)"""
+        return atlas_cache.save_arrays(
+            directory,
+            dict(
+                indptr=self.matrix.indptr,
+                indices=self.matrix.indices,
+                data=self.matrix.data,
+                valid=self.valid,
+                cutoff=np.array(self.cutoff),
+            ),
+        )
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["NeighbourGraph"]:
+        """Memory-map a graph written by `save`. Returns None if it does not exist."""
+        arrays = atlas_cache.load_arrays(
+            directory, ["indptr", "indices", "data", "valid", "cutoff"]
+        )
+        if arrays is None:
+            return None
+        size = len(arrays["valid"])
+        matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]), shape=(size, size)
+        )
+        return cls(matrix, arrays["valid"], float(arrays["cutoff"]))
+
+
+def neighbour_graph_dir(parameters: Parameters) -> Path:
+    source = atlas_cache.source_hash(parameters.reference_db)
+    return atlas_cache.cache_dir(parameters) / f"neighbours_{source[:32]}"
+
+
+def build_neighbour_graph(
+    parameters: Parameters, cutoff: float = NEIGHBOUR_CUTOFF
+) -> NeighbourGraph:
+    """Offline build of the neighbour graph for the reference DB in `parameters`.
+    Builds the fingerprint store first if it does not exist yet.
+    """
+    store = get_fingerprint_store(parameters)
+    if store is None:
+        store = build_fingerprint_store(
+            pd.read_json(parameters.reference_db), parameters
+        )
+    print(f"Building reference database neighbour graph for {len(store)} compounds")
+    graph = NeighbourGraph.from_fingerprints(store, cutoff)
+    graph.save(neighbour_graph_dir(parameters))
+    print(f"Finished neighbour graph with {graph.matrix.nnz} entries")
+    return graph
+
+
+def get_neighbour_graph(parameters: Parameters) -> Optional[NeighbourGraph]:
+    """Memory-mapped neighbour graph for the reference DB in `parameters`.
+    Returns None if caching is disabled or the graph has not been built.
+    """
+    if not parameters.use_cache:
+        return None
+    return atlas_cache.open_store(NeighbourGraph.load, neighbour_graph_dir(parameters))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""Inverted index from taxon names and organism types to reference database rows
+
+Every compound is listed under its organism taxon name, each of the taxon's ancestors and its organism type. Row
+ids are positions in the reference DB file, as in the fingerprint store. Atlas filters then become unions of
+precomputed row id arrays instead of scans over the nested taxon data of every row. The index only depends on the
+reference DB contents, so it is built once per reference DB release, offline, with:
+
+    python -m snapms.atlas_tools.build_cache /path/to/NPAtlas_download.json
+
+Jobs without a built index filter with column scans (see atlas_import.apply_db_filter).
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from snapms.atlas_tools import atlas_cache
+from snapms.config import AtlasFilter, Parameters
+
+# Organism type of the compounds kept by the bacteria and fungi filters
+FILTER_ORGANISM_TYPES = {
+    AtlasFilter.bacteria: "Bacterium",
+    AtlasFilter.fungi: "Fungus",
+}
+
+
+@dataclass
+class LabelRows:
+    """Sorted row ids under each label, stored CSR style: the rows of labels[i] are row_ids[offsets[i]:offsets[i + 1]]"""
+
+    labels: np.ndarray
+    offsets: np.ndarray
+    row_ids: np.ndarray
+
+    @classmethod
+    def from_label_lists(cls, label_lists: Sequence[Iterable[str]]) -> "LabelRows":
+        """Index rows by every label in their label list, with row ids being list positions"""
+        row_labels = [set(labels) for labels in label_lists]
+        rows = np.repeat(
+            np.arange(len(row_labels), dtype=np.int64), [len(r) for r in row_labels]
+        )
+        all_labels = np.array(
+            [label for labels in row_labels for label in labels], dtype=str
+        )
+        labels, codes = np.unique(all_labels, return_inverse=True)
+        # stable sort keeps the rows of every label in ascending order
+        order = np.argsort(codes, kind="stable")
+        offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(labels)), out=offsets[1:])
+        return cls(labels, offsets, rows[order])
+
+    def rows(self, labels: Iterable[str]) -> np.ndarray:
+        """Sorted row ids under any of the labels. Unknown labels have no rows."""
+        labels = list(labels)
+        positions = np.searchsorted(self.labels, labels)
+        row_arrays = [
+            self.row_ids[self.offsets[pos] : self.offsets[pos + 1]]
+            for pos, label in zip(positions.tolist(), labels)
+            if pos < len(self.labels) and self.labels[pos] == label
+        ]
+        if not row_arrays:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(row_arrays))
+
+    def save(self, directory: Path) -> Optional[Path]:
+        """Write the index as a bundle of `.npy` files (see atlas_cache.save_arrays)"""
+        return atlas_cache.save_arrays(
+            directory,
+            dict(labels=self.labels, offsets=self.offsets, row_ids=self.row_ids),
+        )
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["LabelRows"]:
+        """Memory-map an index written by `save`. Returns None if it does not exist."""
+        arrays = atlas_cache.load_arrays(directory, ["labels", "offsets", "row_ids"])
+        if arrays is None:
+            return None
+        return cls(arrays["labels"], arrays["offsets"], arrays["row_ids"])
+
+
+def organism_type_rows(atlas_df: pd.DataFrame) -> LabelRows:
+    """Rows of each organism type in a normalized reference DB dataframe, where row ids are positions"""
+    return LabelRows.from_label_lists(
+        [[t] if isinstance(t, str) else [] for t in atlas_df["origin_organism_type"]]
+    )
+
+
+def taxon_rows(atlas_df: pd.DataFrame) -> LabelRows:
+    """Rows under each taxon name or taxon ancestor name in a normalized reference DB dataframe"""
+    return LabelRows.from_label_lists(
+        [
+            _taxon_names(name, ancestors)
+            for name, ancestors in zip(
+                atlas_df["origin_organism_taxon_name"],
+                atlas_df["origin_organism_taxon_ancestors"],
+            )
+        ]
+    )
+
+
+def filter_labels(
+    filter_type: AtlasFilter, custom_value: Optional[str] = None
+) -> List[str]:
+    """Labels selected by an Atlas filter in its index (see FILTER_INDEXES)"""
+    if filter_type in FILTER_ORGANISM_TYPES:
+        return [FILTER_ORGANISM_TYPES[filter_type]]
+    return custom_filter_names(custom_value)
+
+
+def custom_filter_names(custom_value: str) -> List[str]:
+    """Taxon names in a pipe separated custom filter"""
+    return [name.strip() for name in custom_value.split("|")]
+
+
+def _taxon_names(name, ancestors) -> List[str]:
+    names = [name] if isinstance(name, str) else []
+    if isinstance(ancestors, list):
+        names.extend(a["name"] for a in ancestors if isinstance(a.get("name"), str))
+    return names
+
+
+# Index name and builder used by each Atlas filter, so the bacteria and fungi filters never touch the taxa
+FILTER_INDEXES = {
+    AtlasFilter.bacteria: ("organism_types", organism_type_rows),
+    AtlasFilter.fungi: ("organism_types", organism_type_rows),
+    AtlasFilter.custom: ("taxa", taxon_rows),
+}
+
+
+def taxon_index_dir(parameters: Parameters) -> Path:
+    source = atlas_cache.source_hash(parameters.reference_db)
+    return atlas_cache.cache_dir(parameters) / f"taxa_{source[:32]}"
+
+
+def build_taxon_index(atlas_df: pd.DataFrame, parameters: Parameters) -> None:
+    """Offline build of the organism type and taxon indexes from the unfiltered reference DB"""
+    print("Building reference database taxon index")
+    directory = taxon_index_dir(parameters)
+    for name, build in dict.fromkeys(FILTER_INDEXES.values()):
+        build(atlas_df).save(directory / name)
+
+
+def get_taxon_index(parameters: Parameters) -> Optional[LabelRows]:
+    """Memory-mapped index used by the Atlas filter in `parameters`.
+    Returns None if caching is disabled, the filter keeps every row or the index has not been built.
+    """
+    if not parameters.use_cache or parameters.atlas_filter not in FILTER_INDEXES:
+        return None
+    name, _ = FILTER_INDEXES[parameters.atlas_filter]
+    return atlas_cache.open_store(LabelRows.load, taxon_index_dir(parameters) / name)
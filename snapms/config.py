@@ -4,6 +4,11 @@ from pathlib import Path
 from typing import List, Optional
 
 CYTOSCAPE_DATADIR = Path(getenv("CYTOSCAPE_DATADIR", "/root/data"))
+# Optional TSV file of extra adduct definitions, added to (or overriding) snapms/atlas_tools/adducts.tsv
+ADDUCT_FILE = getenv("SNAPMS_ADDUCT_FILE")
+# Optional location for processed reference DB caches.
+# Defaults to a `snapms_cache` directory next to the reference DB file
+ATLAS_CACHE_DIR = getenv("SNAPMS_CACHE_DIR")
 
 # Defaults
 DEFAULT_ADDUCT_LIST = [
@@ -15,6 +20,10 @@ DEFAULT_ADDUCT_LIST = [
     "2m_plus_h",
     "2m_plus_na",
 ]
+# Extensions of GNPS node tables (cluster summary TSV) accepted in place of the GNPS GraphML network
+GNPS_TABLE_TYPES = ["tsv", "tab"]
+# Memory budget in bytes for candidate similarity scores. Larger clusters are scored blockwise
+DEFAULT_SIMILARITY_MEMORY = 256 * 1024**2
 
 
 class AtlasFilter(str, Enum):
@@ -25,6 +34,11 @@ class AtlasFilter(str, Enum):
     coconut = "coconut"
 
 
+class SimilarityEngine(str, Enum):
+    rdkit = "rdkit"
+    bitpacked = "bitpacked"
+
+
 class Parameters:
     """Class containing all of the setup parameters from SNAP-MS"""
 
@@ -46,6 +60,15 @@ class Parameters:
         compress_output: bool = False,
         atlas_filter: AtlasFilter = AtlasFilter.full,
         custom_filter: Optional[str] = None,
+        use_cache: bool = False,
+        workers: int = 1,
+        similarity_engine: SimilarityEngine = SimilarityEngine.rdkit,
+        similarity_memory: int = DEFAULT_SIMILARITY_MEMORY,
+        similarity_threads: int = 1,
+        similarity_cutoff: float = 0.66,
+        sweep_cutoffs: Optional[List[float]] = None,
+        sweep_ppm_errors: Optional[List[float]] = None,
+        stream_reference_db: bool = False,
     ):
         # I/O options
         # pathlib.Path gives convenient methods for getting name and extension
@@ -71,6 +94,23 @@ class Parameters:
         # filter options
         self.atlas_filter = atlas_filter
         self.custom_filter = custom_filter
+        # persist processed reference DB between jobs
+        self.use_cache = use_cache
+        # number of processes used to build GNPS cluster networks
+        self.workers = workers
+        # fingerprint similarity implementation used for compound network edges
+        self.similarity_engine = similarity_engine
+        # clusters whose dense similarity matrix would exceed similarity_memory are scored in tiles, on a thread pool
+        # of similarity_threads for the bitpacked engine (RDKit holds the GIL, so its tiles are scored serially)
+        self.similarity_memory = similarity_memory
+        self.similarity_threads = similarity_threads
+        # Dice similarity required to create an edge in the compound network
+        self.similarity_cutoff = similarity_cutoff
+        # optional parameter sweep, emitting networks for every ppm error and similarity cutoff in one run
+        self.sweep_cutoffs = sweep_cutoffs
+        self.sweep_ppm_errors = sweep_ppm_errors
+        # stream the reference DB JSON, keeping only the fields used by SNAP-MS
+        self.stream_reference_db = stream_reference_db
 
     def init_output_directory(self) -> Path:
         file_path = self.output_path
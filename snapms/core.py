@@ -1,11 +1,14 @@
 import csv
+from pathlib import Path
+from typing import Dict
 
 import pandas as pd
 
-from snapms.config import CYTOSCAPE_DATADIR, Parameters
+from snapms.config import CYTOSCAPE_DATADIR, GNPS_TABLE_TYPES, Parameters
 from snapms.matching_tools import data_import, match_compounds
 from snapms.network_tools import create_networks
 from snapms.network_tools import cytoscape as cy
+from snapms.network_tools.compound_graph import CompoundGraph
 
 
 def network_from_mass_list(atlas_df: pd.DataFrame, parameters: Parameters):
@@ -28,7 +31,7 @@ def network_from_mass_list(atlas_df: pd.DataFrame, parameters: Parameters):
         target_mass_list, parameters, atlas_df
     )
     print(f"Found {len(compound_list)} candidate adduct masses")
-    compound_network = create_networks.match_compound_network(compound_list, parameters)
+    compound_network = create_networks.build_compound_graph(compound_list, parameters)
     create_networks.remove_small_subgraphs(compound_network, parameters)
     create_networks.annotate_top_candidates(compound_network)
     output_fpath = (
@@ -56,13 +59,61 @@ def network_from_mass_list(atlas_df: pd.DataFrame, parameters: Parameters):
 
 def create_gnps_network_annotations(atlas_df: pd.DataFrame, parameters: Parameters):
     """Function to predict identities of all clusters in GNPS graphML file using cluster mapping algorithm"""
+    if parameters.sweep_cutoffs or parameters.sweep_ppm_errors:
+        sweep_gnps_network_annotations(atlas_df, parameters)
+        return
 
     # Analyze each gnps subgraph to create predictions about possible compound families from atlas data.
     # This is the core function of this suite of tools.
     compound_networks = match_compounds.annotate_gnps_network(atlas_df, parameters)
 
     # write outputs
-    parameters.output_path.mkdir(exist_ok=True)
+    filtered_networks = write_gnps_network_annotations(
+        compound_networks, parameters, parameters.output_path
+    )
+
+    # TODO: Append all Atlas annotation networks to GNPS original network file
+    if cy.cyrest_is_available():
+        print("Cytoscape detected - performing network annotation")
+        if parameters.file_type in GNPS_TABLE_TYPES:
+            original_gnps_network = None
+        else:
+            original_gnps_network = data_import.import_gnps_network(parameters)
+        create_networks.insert_atlas_clusters_to_cytoscape(
+            original_gnps_network, filtered_networks, parameters
+        )
+    else:
+        print("WARNING - Cytoscape Unavailable!")
+    if parameters.compress_output:
+        create_networks.compress_gnps_graphml_outputs(parameters)
+
+
+def sweep_gnps_network_annotations(atlas_df: pd.DataFrame, parameters: Parameters):
+    """Parameter sweep version of create_gnps_network_annotations.
+    Writes the graphML outputs for each ppm error and similarity cutoff to their own output subdirectory.
+    Cytoscape insertion and output compression are skipped.
+    """
+    sweep_networks = match_compounds.sweep_gnps_network(atlas_df, parameters)
+    for (ppm_error, cutoff), compound_networks in sweep_networks.items():
+        print(
+            f"Writing outputs for ppm error {ppm_error} and similarity cutoff {cutoff}"
+        )
+        write_gnps_network_annotations(
+            compound_networks,
+            parameters,
+            parameters.output_path / f"ppm_{ppm_error}_cutoff_{cutoff}",
+        )
+
+
+def write_gnps_network_annotations(
+    compound_networks: Dict[int, CompoundGraph],
+    parameters: Parameters,
+    output_path: Path,
+) -> Dict[int, CompoundGraph]:
+    """Write the graphML output of every annotation network within size limits.
+    Returns the written networks indexed by cluster_id
+    """
+    output_path.mkdir(exist_ok=True, parents=True)
     filtered_networks = {}
     for cluster_id, network in compound_networks.items():
         if create_networks.graph_size_check(
@@ -74,9 +125,7 @@ def create_gnps_network_annotations(atlas_df: pd.DataFrame, parameters: Paramete
         ):
             create_networks.remove_small_subgraphs(network, parameters)
             create_networks.annotate_top_candidates(network)
-            output_fpath = (
-                parameters.output_path / f"GNPS_componentindex_{cluster_id}.graphml"
-            )
+            output_fpath = output_path / f"GNPS_componentindex_{cluster_id}.graphml"
             create_networks.export_graphml(network, parameters, output_fpath)
             filtered_networks[cluster_id] = network
         else:
@@ -84,15 +133,4 @@ def create_gnps_network_annotations(atlas_df: pd.DataFrame, parameters: Paramete
                 f"ERROR: Atlas annotation graph {cluster_id} either too small or too large. "
                 "Skipping insert."
             )
-
-    # TODO: Append all Atlas annotation networks to GNPS original network file
-    if cy.cyrest_is_available():
-        print("Cytoscape detected - performing network annotation")
-        original_gnps_network = data_import.import_gnps_network(parameters)
-        create_networks.insert_atlas_clusters_to_cytoscape(
-            original_gnps_network, filtered_networks, parameters
-        )
-    else:
-        print("WARNING - Cytoscape Unavailable!")
-    if parameters.compress_output:
-        create_networks.compress_gnps_graphml_outputs(parameters)
+    return filtered_networks
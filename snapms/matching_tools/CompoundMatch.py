@@ -1,5 +1,12 @@
 import re
 from dataclasses import dataclass
+from typing import Iterator, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+NPATLAS_URL = "https://www.npatlas.org/explore/compounds/{}"
+COCONUT_URL = "https://coconut.naturalproducts.net/compound/coconut_id/{}"
 
 
 @dataclass
@@ -18,26 +25,107 @@ class CompoundMatch:
 
     @property
     def npatlas_url(self) -> str:
-        return f"https://www.npatlas.org/explore/compounds/{self.npaid}"
+        return NPATLAS_URL.format(self.npaid)
 
     @property
     def coconut_url(self) -> str:
-        return (
-            f"https://coconut.naturalproducts.net/compound/coconut_id/{self.coconut_id}"
-        )
+        return COCONUT_URL.format(self.coconut_id)
 
     def friendly_name(self) -> str:
-        """JvS - This should no longer be required with unicode normalization on atlas import
-        but there are still some issues
-        Elementree has some problems reading special characters from the Atlas input because the input is
-        occasionally not clean UTF-8. This if/ else statement cleans up names to eliminate crashes due to string
-        parsing failure from the graphML file."""
-        if re.match(
-            r"^[A-Za-z0-9 α-ωΑ-Ω\-‐~,\"'$&*()±\[\]′’+./–″<>−{}|_:;]+$", self.name
-        ):
-            return xml_safe_name(self.name)
-        else:
-            return "Unknown"
+        return friendly_name(self.name)
+
+
+@dataclass(eq=False)
+class CompoundMatchTable(Sequence):
+    """Struct-of-arrays container for compound matches between query adduct masses and NP Atlas
+
+    Each match is stored as a position in the aligned arrays, referring back into the Atlas dataframe by
+    row position. CompoundMatch objects are only created on demand when indexing or iterating.
+    """
+
+    atlas_df: pd.DataFrame
+    # Atlas row position for each match
+    rows: np.ndarray
+    # query mass, compound number and adduct (as position in adduct_list) for each match
+    masses: np.ndarray
+    compound_numbers: np.ndarray
+    adduct_codes: np.ndarray
+    adduct_list: List[str]
+    # Atlas identifier column, npaid or coconut_id
+    id_col: str = "npaid"
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.subset(idx)
+        return self.subset([idx]).to_compound_matches()[0]
+
+    def __iter__(self) -> Iterator[CompoundMatch]:
+        return iter(self.to_compound_matches())
+
+    def subset(self, positions) -> "CompoundMatchTable":
+        """New table holding only the matches at `positions`"""
+        return CompoundMatchTable(
+            atlas_df=self.atlas_df,
+            rows=self.rows[positions],
+            masses=self.masses[positions],
+            compound_numbers=self.compound_numbers[positions],
+            adduct_codes=self.adduct_codes[positions],
+            adduct_list=self.adduct_list,
+            id_col=self.id_col,
+        )
+
+    def column(self, name: str) -> np.ndarray:
+        """Values of an Atlas column for each match"""
+        series = self.atlas_df[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # take codes rather than materializing the whole column
+            return np.asarray(series.array.take(self.rows), dtype=object)
+        return series.to_numpy()[self.rows]
+
+    def display_names(self) -> List[str]:
+        """XML-safe compound name for each match, precomputed at Atlas import if available"""
+        if "display_name" in self.atlas_df:
+            return self.column("display_name").tolist()
+        return [friendly_name(n) for n in self.column("name")]
+
+    @property
+    def row_ids(self) -> np.ndarray:
+        """Atlas index label (reference DB row id) for each match"""
+        return self.atlas_df.index.to_numpy()[self.rows]
+
+    @property
+    def adducts(self) -> np.ndarray:
+        """Adduct name for each match"""
+        return np.array(self.adduct_list, dtype=object)[self.adduct_codes]
+
+    def to_compound_matches(self) -> List[CompoundMatch]:
+        """Create a CompoundMatch object for every match"""
+        missing_id_col = "coconut_id" if self.id_col == "npaid" else "npaid"
+        selected_compounds = self.atlas_df.iloc[self.rows][
+            [self.id_col, "exact_mass", "smiles", "name", "origin_organism_type"]
+        ]
+        selected_compounds["mass"] = self.masses
+        selected_compounds["compound_number"] = self.compound_numbers
+        selected_compounds["adduct"] = self.adducts
+        selected_compounds[missing_id_col] = None
+        return [
+            CompoundMatch(**c) for c in selected_compounds.to_dict(orient="records")
+        ]
+
+
+def friendly_name(name: str) -> str:
+    """JvS - This should no longer be required with unicode normalization on atlas import
+    but there are still some issues
+    Elementree has some problems reading special characters from the Atlas input because the input is
+    occasionally not clean UTF-8. This if/ else statement cleans up names to eliminate crashes due to string
+    parsing failure from the graphML file."""
+    if re.match(r"^[A-Za-z0-9 α-ωΑ-Ω\-‐~,\"'$&*()±\[\]′’+./–″<>−{}|_:;]+$", name):
+        return xml_safe_name(name)
+    else:
+        return "Unknown"
 
 
 def xml_safe_name(n):
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""Sorted adduct mass index for binary search candidate lookup against the reference DB
+
+For each adduct, the index holds the adduct masses of the reference DB sorted ascending plus the
+permutation back to dataframe row positions. When caching is enabled the arrays are stored as one bundle in the
+reference DB cache (see atlas_cache.save_arrays) and memory-mapped, so every worker process on a host shares the
+same pages.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from snapms.atlas_tools import atlas_cache
+from snapms.atlas_tools.atlas_import import atlas_adduct_matrix
+from snapms.config import Parameters
+
+
+class AdductIndex:
+    """Class holding sorted adduct masses and their row positions in the reference DB dataframe"""
+
+    def __init__(self, masses: Dict[str, np.ndarray], rows: Dict[str, np.ndarray]):
+        self.masses = masses
+        self.rows = rows
+
+    @property
+    def adducts(self) -> List[str]:
+        return list(self.masses)
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, adduct_list: List[str]) -> "AdductIndex":
+        """Build the index in memory from a (rows x adducts) adduct mass matrix, sorting every adduct column at once"""
+        # stable sort keeps dataframe order for identical masses
+        order = np.argsort(matrix, axis=0, kind="stable")
+        sorted_masses = np.take_along_axis(matrix, order, axis=0)
+        masses = {
+            adduct: np.ascontiguousarray(sorted_masses[:, position])
+            for position, adduct in enumerate(adduct_list)
+        }
+        rows = {
+            adduct: np.ascontiguousarray(order[:, position], dtype=np.int64)
+            for position, adduct in enumerate(adduct_list)
+        }
+        return cls(masses, rows)
+
+    def ranges(
+        self, adduct: str, low: np.ndarray, high: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Batched binary search. Returns start and stop positions into the sorted masses of `adduct`
+        for every `low <= adduct mass <= high` window.
+        """
+        masses = self.masses[adduct]
+        start = np.searchsorted(masses, low, side="left")
+        stop = np.searchsorted(masses, high, side="right")
+        return start, np.maximum(stop, start)
+
+    def save(self, directory: Path) -> Optional[Path]:
+        """Write the index as one array bundle, with the sorted masses and rows of each adduct plus the adduct names"""
+        arrays = {"adducts": np.array(self.adducts, dtype=str)}
+        for adduct in self.adducts:
+            arrays[f"{adduct}.masses"] = self.masses[adduct]
+            arrays[f"{adduct}.rows"] = self.rows[adduct]
+        return atlas_cache.save_arrays(directory, arrays)
+
+    @classmethod
+    def load(cls, directory: Path, adduct_list: List[str]) -> Optional["AdductIndex"]:
+        """Memory-map an index written by `save`. Returns None if the bundle is not complete or lacks an adduct."""
+        stored = atlas_cache.load_arrays(directory, ["adducts"])
+        if stored is None or not set(adduct_list) <= set(stored["adducts"].tolist()):
+            return None
+        arrays = atlas_cache.load_arrays(
+            directory,
+            [
+                f"{adduct}.{name}"
+                for adduct in adduct_list
+                for name in ("masses", "rows")
+            ],
+        )
+        masses = {adduct: arrays[f"{adduct}.masses"] for adduct in adduct_list}
+        rows = {adduct: arrays[f"{adduct}.rows"] for adduct in adduct_list}
+        return cls(masses, rows)
+
+
+def adduct_index_dir(parameters: Parameters) -> Path:
+    return (
+        atlas_cache.cache_dir(parameters)
+        / f"adduct_index_{atlas_cache.cache_key(parameters)}"
+    )
+
+
+def get_adduct_index(atlas_df: pd.DataFrame, parameters: Parameters) -> AdductIndex:
+    """Get the adduct index for a processed reference DB.
+
+    With `parameters.use_cache` the memory-mapped index in the reference DB cache is used, and written
+    there first if missing. Otherwise the index is built in memory, straight from the adduct mass matrix.
+    """
+    adduct_list = parameters.adduct_list
+    if parameters.use_cache:
+        index = AdductIndex.load(adduct_index_dir(parameters), adduct_list)
+        if index is not None and all(
+            len(r) == len(atlas_df) for r in index.rows.values()
+        ):
+            return index
+    index = AdductIndex.from_matrix(
+        atlas_adduct_matrix(atlas_df, adduct_list), adduct_list
+    )
+    if parameters.use_cache:
+        index.save(adduct_index_dir(parameters))
+    return index
@@ -1,22 +1,205 @@
 """Tools to import peak lists or gnps networks to SNAP-MS"""
 
+import csv
 import tempfile
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree
 
 import networkx as nx
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 
-from snapms.config import Parameters
+from snapms.config import GNPS_TABLE_TYPES, Parameters
+
+GRAPHML_NS = "{http://graphml.graphdrawing.org/xmlns}"
+PARENT_MASS = "parent mass"
+COMPONENT_INDEX = "componentindex"
+# node id column of the GNPS cluster summary table
+CLUSTER_INDEX = "cluster index"
+# componentindex GNPS assigns to nodes without any network partner
+SINGLETON_COMPONENT = -1
+
+
+@dataclass
+class GNPSNetwork:
+    """The parts of a GNPS network used for Atlas annotation
+
+    Nodes are numbered by their order in the GraphML file. node_ids holds the GraphML node ids, parent_masses
+    and component_ids the `parent mass` and `componentindex` of each node, and edges an (n_edges, 2) array of
+    node positions. component_ids is None if any node has no componentindex.
+    """
+
+    node_ids: np.ndarray
+    parent_masses: np.ndarray
+    component_ids: Optional[np.ndarray]
+    edges: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def adjacency(self) -> sparse.csr_matrix:
+        """Undirected adjacency matrix between node positions"""
+        upper = sparse.coo_matrix(
+            (
+                np.ones(len(self.edges), dtype=np.int8),
+                (self.edges[:, 0], self.edges[:, 1]),
+            ),
+            shape=(len(self), len(self)),
+        )
+        return (upper + upper.T).tocsr()
+
+    def clusters(self) -> Tuple[List[int], List[np.ndarray]]:
+        """Cluster id and node positions of every GNPS cluster.
+
+        Clusters are listed in order of their first node and their node positions in file order. Nodes are
+        bucketed by componentindex, and singletons (componentindex -1) each form their own cluster. Without
+        componentindex, clusters are the connected components of the network, numbered from 1.
+        """
+        if self.component_ids is None:
+            _, labels = connected_components(self.adjacency(), directed=False)
+            cluster_ids = None
+        else:
+            singletons = self.component_ids == SINGLETON_COMPONENT
+            # singletons get keys below every componentindex so they never share a bucket
+            keys = np.where(singletons, -1 - np.arange(len(self)), self.component_ids)
+            _, first_nodes, labels = np.unique(
+                keys, return_index=True, return_inverse=True
+            )
+            # relabel buckets in order of their first node
+            rank = np.empty(len(first_nodes), dtype=np.int64)
+            rank[np.argsort(first_nodes, kind="stable")] = np.arange(len(first_nodes))
+            labels = rank[labels]
+            cluster_ids = self.component_ids
+        order = np.argsort(labels, kind="stable")
+        sizes = np.bincount(labels) if len(labels) else np.empty(0, dtype=np.int64)
+        cluster_nodes = np.split(order, np.cumsum(sizes)[:-1]) if len(sizes) else []
+        if cluster_ids is None:
+            return list(range(1, len(cluster_nodes) + 1)), cluster_nodes
+        return [int(cluster_ids[nodes[0]]) for nodes in cluster_nodes], cluster_nodes
 
 
 def fix_long_dtype(fpath: Path) -> tempfile.TemporaryFile:
     temp_f = tempfile.TemporaryFile()
     with open(fpath, encoding="utf-8") as f:
-        for l in f.readlines():
+        for l in f:
             temp_f.write(l.replace('attr.type="long"', 'attr.type="int"').encode())
     temp_f.seek(0)
     return temp_f
 
 
+def read_gnps_graphml(fpath: Path) -> GNPSNetwork:
+    """Stream a GNPS GraphML file, keeping only node ids, parent masses, component indices and edges.
+
+    Elements are discarded as soon as they are parsed, so memory scales with the extracted arrays rather than
+    the document. Values are parsed as numbers whatever their declared attr.type, so `long` needs no special
+    handling. Edge direction is ignored.
+    """
+    key_names: Dict[str, str] = {}
+    defaults: Dict[str, str] = {}
+    positions: Dict[str, int] = {}
+    masses: List[float] = []
+    components: List[int] = []
+    edge_ids: List[tuple] = []
+    node_values: Dict[str, str] = {}
+    has_components = True
+    graph = None
+    for event, elem in ElementTree.iterparse(str(fpath), events=("start", "end")):
+        tag = elem.tag.replace(GRAPHML_NS, "")
+        if event == "start":
+            if tag == "node":
+                node_values = {}
+            elif tag == "graph":
+                graph = elem
+            continue
+        if tag == "key":
+            if elem.get("for") in ("node", "all") and elem.get("attr.name") in (
+                PARENT_MASS,
+                COMPONENT_INDEX,
+            ):
+                key_names[elem.get("id")] = elem.get("attr.name")
+                default = elem.find(f"{GRAPHML_NS}default")
+                if default is not None:
+                    defaults[elem.get("attr.name")] = default.text
+        elif tag == "data":
+            name = key_names.get(elem.get("key"))
+            if name is not None:
+                node_values[name] = elem.text
+        elif tag == "node":
+            values = {**defaults, **node_values}
+            if PARENT_MASS not in values:
+                raise ValueError(
+                    f"GNPS node {elem.get('id')} has no '{PARENT_MASS}' attribute"
+                )
+            positions[elem.get("id")] = len(positions)
+            masses.append(float(values[PARENT_MASS]))
+            if COMPONENT_INDEX in values:
+                components.append(int(float(values[COMPONENT_INDEX])))
+            else:
+                has_components = False
+            graph.clear()
+        elif tag == "edge":
+            edge_ids.append((elem.get("source"), elem.get("target")))
+            graph.clear()
+    try:
+        edges = np.array(
+            [(positions[u], positions[v]) for u, v in edge_ids], dtype=np.int64
+        ).reshape(-1, 2)
+    except KeyError as e:
+        raise ValueError(f"GNPS edge refers to undefined node {e}") from e
+    node_ids = np.empty(len(positions), dtype=object)
+    node_ids[:] = list(positions)
+    return GNPSNetwork(
+        node_ids,
+        np.array(masses, dtype=np.float64),
+        np.array(components, dtype=np.int64) if has_components else None,
+        edges,
+    )
+
+
+def read_gnps_node_table(fpath: Path) -> GNPSNetwork:
+    """Stream a GNPS node table (cluster summary TSV), keeping only the parent mass and componentindex columns.
+
+    Nodes are identified by their `cluster index` if the table has one, otherwise by their row number. The table
+    has no edges, so clusters are always taken from componentindex.
+    """
+    with open(fpath, encoding="utf-8", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, [])
+        missing = [c for c in (PARENT_MASS, COMPONENT_INDEX) if c not in header]
+        if missing:
+            raise ValueError(f"GNPS node table {fpath.name} has no {missing} columns")
+        mass_col = header.index(PARENT_MASS)
+        component_col = header.index(COMPONENT_INDEX)
+        id_col = header.index(CLUSTER_INDEX) if CLUSTER_INDEX in header else None
+        node_ids = []
+        masses = []
+        components = []
+        for row in reader:
+            if not row:
+                continue
+            node_ids.append(row[id_col] if id_col is not None else str(len(node_ids)))
+            masses.append(float(row[mass_col]))
+            components.append(int(float(row[component_col])))
+    node_id_array = np.empty(len(node_ids), dtype=object)
+    node_id_array[:] = node_ids
+    return GNPSNetwork(
+        node_id_array,
+        np.array(masses, dtype=np.float64),
+        np.array(components, dtype=np.int64),
+        np.empty((0, 2), dtype=np.int64),
+    )
+
+
+def read_gnps_network(parameters: Parameters) -> GNPSNetwork:
+    """Read the GNPS input file, either a GNPS node table or the GraphML network"""
+    if parameters.file_type in GNPS_TABLE_TYPES:
+        return read_gnps_node_table(parameters.file_path)
+    return read_gnps_graphml(parameters.file_path)
+
+
 def import_gnps_network(parameters: Parameters):
     """Import the original GNPS network file (graphML) downloaded from the GNPS output site"""
     # Networkx 2.5 has a bug which fails to read `long` data from graphML
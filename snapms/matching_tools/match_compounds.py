@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 
 """Tools to match masses from mass list to compounds from Atlas"""
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-import networkx as nx
+import numpy as np
 import pandas as pd
 
 from snapms.config import Parameters
 from snapms.matching_tools import data_import
-from snapms.matching_tools.CompoundMatch import CompoundMatch
+from snapms.matching_tools.adduct_index import AdductIndex, get_adduct_index
+from snapms.matching_tools.CompoundMatch import CompoundMatchTable
 from snapms.network_tools import create_networks
+from snapms.network_tools.compound_graph import CompoundGraph
 
 
 def calculate_error(mass: float, mass_error: float, precision: int = 4) -> float:
@@ -18,29 +21,100 @@ def calculate_error(mass: float, mass_error: float, precision: int = 4) -> float
     return round((mass * mass_error) / 1e6, precision)
 
 
+def calculate_errors(
+    masses: np.ndarray, mass_error: float, precision: int = 4
+) -> np.ndarray:
+    """Calculate ppm error for an array of masses.
+    Uses calculate_error per mass so rounding is identical to the scalar version.
+    """
+    return np.array(
+        [calculate_error(m, mass_error, precision) for m in masses.tolist()],
+        dtype=np.float64,
+    )
+
+
 def remove_mass_duplicates(mass_list: List[float], ppm_error: float) -> List[float]:
     """Remove masses in mass list within ppm error of existing masses
     Keeps the first.
     """
+    return [mass_list[pos] for pos in unique_mass_positions(mass_list, ppm_error)]
 
-    deduplicated_mass_list = []
 
-    for mass in mass_list:
-        insert_mass = True
-        mass_error = calculate_error(mass, ppm_error)
-        for deduplicated_mass in deduplicated_mass_list:
-            if mass - mass_error <= deduplicated_mass <= mass + mass_error:
-                insert_mass = False
-                break
-        if insert_mass:
-            deduplicated_mass_list.append(mass)
+def unique_mass_positions(masses: np.ndarray, ppm_error: float) -> np.ndarray:
+    """Positions of the masses kept after removing masses within ppm error of an earlier kept mass.
+    Positions are returned in input order, so `masses[unique_mass_positions(masses, ppm)]` is the deduplicated array.
 
-    return deduplicated_mass_list
+    Masses are sorted once and each ppm window becomes a contiguous slice of the sorted array, found by
+    binary search. Masses alone in their window are always kept. The remaining masses are swept in input order
+    and kept if no earlier kept mass falls inside their window.
+    """
+    masses = np.asarray(masses, dtype=np.float64)
+    mass_errors = calculate_errors(masses, ppm_error)
+    order = np.argsort(masses, kind="stable")
+    sorted_masses = masses[order]
+    window_start = np.searchsorted(sorted_masses, masses - mass_errors, side="left")
+    window_stop = np.searchsorted(sorted_masses, masses + mass_errors, side="right")
+    sorted_rank = np.empty(len(masses), dtype=np.int64)
+    sorted_rank[order] = np.arange(len(masses))
+    # input position of each kept mass in sorted order, len(masses) if not kept
+    kept_positions = np.full(len(masses), len(masses), dtype=np.int64)
+    contested = window_stop - window_start > 1
+    uncontested = np.flatnonzero(~contested)
+    kept_positions[sorted_rank[uncontested]] = uncontested
+    for pos in np.flatnonzero(contested).tolist():
+        start = window_start[pos]
+        stop = window_stop[pos]
+        if not (kept_positions[start:stop] < pos).any():
+            kept_positions[sorted_rank[pos]] = pos
+    return np.sort(kept_positions[kept_positions < len(masses)])
+
+
+def match_mass_array(
+    masses: np.ndarray,
+    ppm_error: float,
+    adduct_index: AdductIndex,
+    adduct_list: List[str],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized matching of all masses against all adducts using binary search on the sorted adduct masses.
+
+    Returns three aligned arrays of (mass position, adduct position, atlas row position) for each match,
+    sorted by mass, then adduct, then atlas row. This is the same order as scanning the atlas for each
+    mass and adduct in turn.
+    """
+    if not adduct_list:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    masses = np.asarray(masses, dtype=np.float64)
+    mass_errors = calculate_errors(masses, ppm_error)
+    low = masses - mass_errors
+    high = masses + mass_errors
+    mass_positions = []
+    adduct_positions = []
+    row_positions = []
+    for adduct_position, adduct in enumerate(adduct_list):
+        start, stop = adduct_index.ranges(adduct, low, high)
+        counts = stop - start
+        # expand each [start, stop) window into the sorted positions it covers
+        window_offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        sorted_positions = np.repeat(start, counts) + window_offsets
+        mass_positions.append(np.repeat(np.arange(len(masses)), counts))
+        adduct_positions.append(np.full(len(sorted_positions), adduct_position))
+        row_positions.append(np.asarray(adduct_index.rows[adduct])[sorted_positions])
+    mass_positions = np.concatenate(mass_positions)
+    adduct_positions = np.concatenate(adduct_positions)
+    row_positions = np.concatenate(row_positions)
+    order = np.lexsort((row_positions, adduct_positions, mass_positions))
+    return mass_positions[order], adduct_positions[order], row_positions[order]
 
 
 def compute_adduct_matches(
-    mass_list: List[float], parameters: Parameters, atlas_df: pd.DataFrame
-) -> List[CompoundMatch]:
+    mass_list: List[float],
+    parameters: Parameters,
+    atlas_df: pd.DataFrame,
+    adduct_index: Optional[AdductIndex] = None,
+) -> CompoundMatchTable:
     """Tool to search the Atlas for a given mass, and return all compounds with that mass as a specific adduct,
     within a given mass error
 
@@ -50,58 +124,63 @@ def compute_adduct_matches(
     adduct list should be a list of adducts that are present in the Atlas dataframe. By default only 'H' and 'Na' are
     present
     atlas_df is the dataframe from atlas_tools.atlas_import after cleaning/processing has been applied
+    adduct_index is the sorted adduct mass index for atlas_df. Looked up with get_adduct_index if not provided
+
+    Returns a CompoundMatchTable, which yields CompoundMatch objects on iteration
     """
-    output_list = []
-    for index, mass in enumerate(mass_list):
-        mass_error = calculate_error(mass, parameters.ppm_error)
-
-        if parameters.atlas_filter == "coconut":
-            for adduct in parameters.adduct_list:
-                selected_compounds = atlas_df[
-                    atlas_df[adduct].between(mass - mass_error, mass + mass_error)
-                ][
-                    [
-                        "coconut_id",
-                        "exact_mass",
-                        "smiles",
-                        "name",
-                        "origin_organism_type",
-                    ]
-                ]
-                if not selected_compounds.empty:
-                    selected_compounds["mass"] = mass
-                    selected_compounds["compound_number"] = index + 1
-                    selected_compounds["adduct"] = adduct
-                    selected_compounds["npaid"] = None
-                    # Use a dataclass for verbosity in other code
-                    # avoids needing to know list indices
-                    output_list += [
-                        CompoundMatch(**c)
-                        for c in selected_compounds.to_dict(orient="records")
-                    ]
-        else:
-            for adduct in parameters.adduct_list:
-                selected_compounds = atlas_df[
-                    atlas_df[adduct].between(mass - mass_error, mass + mass_error)
-                ][["npaid", "exact_mass", "smiles", "name", "origin_organism_type"]]
-                if not selected_compounds.empty:
-                    selected_compounds["mass"] = mass
-                    selected_compounds["compound_number"] = index + 1
-                    selected_compounds["adduct"] = adduct
-                    selected_compounds["coconut_id"] = None
-                    # Use a dataclass for verbosity in other code
-                    # avoids needing to know list indices
-                    output_list += [
-                        CompoundMatch(**c)
-                        for c in selected_compounds.to_dict(orient="records")
-                    ]
-
-    return output_list
+    return compute_cluster_adduct_matches(
+        [mass_list], parameters, atlas_df, adduct_index
+    )[0]
+
+
+def compute_cluster_adduct_matches(
+    mass_lists: List[List[float]],
+    parameters: Parameters,
+    atlas_df: pd.DataFrame,
+    adduct_index: Optional[AdductIndex] = None,
+    ppm_error: Optional[float] = None,
+) -> List[CompoundMatchTable]:
+    """Batched version of compute_adduct_matches for many mass lists (e.g. GNPS clusters) at once.
+
+    All masses are tagged with the position of their mass list and matched against the Atlas in a single
+    vectorized pass. Results are split back out per mass list, with compound numbers counted within each list.
+    ppm_error overrides parameters.ppm_error if given.
+    Returns a table of compound matches for each mass list, in the same order as mass_lists.
+    """
+    if ppm_error is None:
+        ppm_error = parameters.ppm_error
+    if adduct_index is None:
+        adduct_index = get_adduct_index(atlas_df, parameters)
+    list_sizes = np.array([len(m) for m in mass_lists], dtype=np.int64)
+    list_offsets = np.cumsum(list_sizes) - list_sizes
+    masses = np.array(
+        [mass for mass_list in mass_lists for mass in mass_list], dtype=np.float64
+    )
+    list_tags = np.repeat(np.arange(len(mass_lists)), list_sizes)
+    mass_positions, adduct_positions, rows = match_mass_array(
+        masses, ppm_error, adduct_index, parameters.adduct_list
+    )
+    match_tags = list_tags[mass_positions]
+    compound_matches = CompoundMatchTable(
+        atlas_df=atlas_df,
+        rows=rows,
+        masses=masses[mass_positions],
+        compound_numbers=mass_positions - list_offsets[match_tags] + 1,
+        adduct_codes=adduct_positions,
+        adduct_list=list(parameters.adduct_list),
+        id_col="coconut_id" if parameters.atlas_filter == "coconut" else "npaid",
+    )
+    # matches are ordered by mass position, so each mass list is one contiguous slice
+    bounds = np.searchsorted(match_tags, np.arange(len(mass_lists) + 1))
+    return [
+        compound_matches[bounds[idx] : bounds[idx + 1]]
+        for idx in range(len(mass_lists))
+    ]
 
 
 def annotate_gnps_network(
     atlas_df: pd.DataFrame, parameters: Parameters
-) -> Dict[int, nx.Graph]:
+) -> Dict[int, CompoundGraph]:
     """Tool to create structure class predictions from GNPS clusters by identifying the compound classes with the
     highest prevalence in the GNPS network.
 
@@ -114,34 +193,233 @@ def annotate_gnps_network(
     Returns Dict of compound graphs for each GNPS cluster indexed by cluster_id
     """
 
-    gnps_network = data_import.import_gnps_network(parameters)
-    networks = {}
-    for cluster in nx.connected_components(gnps_network):
-        if len(cluster) >= parameters.min_gnps_cluster_size:
-            cluster_id = int(gnps_network.nodes[list(cluster)[0]]["componentindex"])
+    adduct_index = get_adduct_index(atlas_df, parameters)
+    cluster_ids = []
+    cluster_mass_lists = []
+    for cluster_id, target_mass_list in zip(*gnps_cluster_mass_lists(parameters)):
+        if parameters.remove_duplicates:
+            target_mass_list = remove_mass_duplicates(
+                target_mass_list, parameters.ppm_error
+            )
+        # if gnps mass list contains appropriate number of members, perform Atlas annotation
+        if (
+            parameters.min_gnps_cluster_size
+            <= len(target_mass_list)
+            <= parameters.max_gnps_cluster_size
+        ):
+            cluster_ids.append(cluster_id)
+            cluster_mass_lists.append(target_mass_list)
+        else:
+            print(f"Skipping Atlas annotation for GNPS cluster {cluster_id}")
+
+    # Match every eligible cluster against the Atlas in a single pass
+    cluster_compound_lists = compute_cluster_adduct_matches(
+        cluster_mass_lists, parameters, atlas_df, adduct_index
+    )
+    return build_cluster_networks(
+        cluster_ids, cluster_compound_lists, atlas_df, parameters
+    )
+
+
+def gnps_cluster_mass_lists(
+    parameters: Parameters,
+) -> Tuple[List[int], List[List[float]]]:
+    """Component index and parent mass list of every GNPS cluster with at least min_gnps_cluster_size nodes.
+    Clusters are listed in order of their first node in the input file, with masses in file order.
+    """
+    gnps_network = data_import.read_gnps_network(parameters)
+    cluster_ids = []
+    mass_lists = []
+    for cluster_id, nodes in zip(*gnps_network.clusters()):
+        if len(nodes) >= parameters.min_gnps_cluster_size:
+            cluster_ids.append(cluster_id)
             # Create gnps mass list
-            target_mass_list = [
-                gnps_network.nodes[node]["parent mass"] for node in cluster
-            ]
+            mass_lists.append(gnps_network.parent_masses[nodes].tolist())
+    return cluster_ids, mass_lists
+
+
+def sweep_gnps_network(
+    atlas_df: pd.DataFrame, parameters: Parameters
+) -> Dict[Tuple[float, float], Dict[int, CompoundGraph]]:
+    """Parameter sweep version of annotate_gnps_network over parameters.sweep_ppm_errors and
+    parameters.sweep_cutoffs (defaulting to ppm_error and similarity_cutoff).
+
+    Each cluster is matched once at the largest ppm error, using the union of the masses kept by duplicate
+    removal at every ppm error, and its candidate similarity pairs are computed once at the lowest cutoff.
+    Networks for each ppm error select their matches from that superset and each cutoff selects its edges,
+    giving the same networks as separate runs.
+
+    Returns Dict of (ppm error, similarity cutoff) to the compound graphs for each GNPS cluster indexed by cluster_id
+    """
+    ppm_errors = parameters.sweep_ppm_errors or [parameters.ppm_error]
+    cutoffs = parameters.sweep_cutoffs or [parameters.similarity_cutoff]
+    adduct_index = get_adduct_index(atlas_df, parameters)
+    cluster_ids = []
+    superset_positions = []
+    superset_mass_lists = []
+    kept_positions = []
+    for cluster_id, mass_list in zip(*gnps_cluster_mass_lists(parameters)):
+        kept = {}
+        for ppm_error in ppm_errors:
             if parameters.remove_duplicates:
-                target_mass_list = remove_mass_duplicates(
-                    target_mass_list, parameters.ppm_error
-                )
-            # if gnps mass list contains appropriate number of members, perform Atlas annotation
+                positions = unique_mass_positions(mass_list, ppm_error)
+            else:
+                positions = np.arange(len(mass_list))
             if (
                 parameters.min_gnps_cluster_size
-                <= len(target_mass_list)
+                <= len(positions)
                 <= parameters.max_gnps_cluster_size
             ):
-                atlas_compound_list = compute_adduct_matches(
-                    target_mass_list, parameters, atlas_df
-                )
-                compound_network = create_networks.match_compound_network(
-                    atlas_compound_list, parameters
+                kept[ppm_error] = positions
+        if not kept:
+            print(f"Skipping Atlas annotation for GNPS cluster {cluster_id}")
+            continue
+        cluster_ids.append(cluster_id)
+        kept_positions.append(kept)
+        superset_positions.append(np.unique(np.concatenate(list(kept.values()))))
+        superset_mass_lists.append([mass_list[pos] for pos in superset_positions[-1]])
+    superset_tables = compute_cluster_adduct_matches(
+        superset_mass_lists,
+        parameters,
+        atlas_df,
+        adduct_index,
+        ppm_error=max(ppm_errors),
+    )
+
+    networks = {
+        (ppm_error, cutoff): {} for ppm_error in ppm_errors for cutoff in cutoffs
+    }
+    for idx in sorted(range(len(cluster_ids)), key=lambda i: cluster_ids[i]):
+        cluster_id = cluster_ids[idx]
+        table = superset_tables[idx]
+        similarity = create_networks.CandidateSimilarity.from_matches(
+            table, parameters, min(cutoffs)
+        )
+        for ppm_error, kept in kept_positions[idx].items():
+            positions, compound_numbers = ppm_error_matches(
+                table, superset_positions[idx], kept, ppm_error
+            )
+            ppm_table = table.subset(positions)
+            ppm_table.compound_numbers = compound_numbers
+            # node attributes only depend on the matches, edges on the cutoff
+            base_network = create_networks.build_compound_graph(
+                ppm_table, parameters, edge_list=np.empty((0, 2), dtype=np.int64)
+            )
+            base_network.set_node_attribute("componentindex", cluster_id)
+            for cutoff in cutoffs:
+                networks[(ppm_error, cutoff)][cluster_id] = base_network.with_edges(
+                    similarity.edges(cutoff, compound_numbers, positions)
                 )
-                nx.set_node_attributes(
-                    compound_network, cluster_id, name="componentindex"
+        print("Finished Atlas annotation sweep for GNPS cluster " + str(cluster_id))
+    return networks
+
+
+def ppm_error_matches(
+    superset_table: CompoundMatchTable,
+    superset_positions: np.ndarray,
+    kept_positions: np.ndarray,
+    ppm_error: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Select the matches of a smaller ppm error from a table matched at a larger one.
+
+    superset_positions are the mass list positions matched in superset_table and kept_positions the positions
+    kept by duplicate removal at ppm_error. Matches are kept if their mass is kept and the adduct mass falls in
+    the ppm_error window, compared exactly as in match_mass_array.
+    Returns the positions of the kept matches in superset_table and their compound numbers within the kept masses.
+    """
+    mass_positions = superset_positions[superset_table.compound_numbers - 1]
+    keep = np.isin(mass_positions, kept_positions)
+    masses = superset_table.masses
+    mass_errors = calculate_errors(masses, ppm_error)
+    adduct_masses = np.empty(len(superset_table), dtype=np.float64)
+    for code, adduct in enumerate(superset_table.adduct_list):
+        selected = superset_table.adduct_codes == code
+        adduct_masses[selected] = superset_table.atlas_df[adduct].to_numpy(
+            dtype=np.float64
+        )[superset_table.rows[selected]]
+    keep &= (masses - mass_errors <= adduct_masses) & (
+        adduct_masses <= masses + mass_errors
+    )
+    positions = np.flatnonzero(keep)
+    compound_numbers = np.searchsorted(kept_positions, mass_positions[positions]) + 1
+    return positions, compound_numbers
+
+
+def build_cluster_networks(
+    cluster_ids: List[int],
+    compound_tables: List[CompoundMatchTable],
+    atlas_df: pd.DataFrame,
+    parameters: Parameters,
+) -> Dict[int, CompoundGraph]:
+    """Create the compound network for each GNPS cluster from its compound matches.
+
+    Clusters are processed in componentindex order. With `parameters.workers` > 1 they are processed in a
+    process pool. Each worker receives the Atlas once when it starts, and tasks only carry the match arrays.
+    Returns Dict of compound graphs for each GNPS cluster indexed by cluster_id
+    """
+    order = sorted(range(len(cluster_ids)), key=lambda idx: cluster_ids[idx])
+    networks = {}
+    if parameters.workers > 1 and len(order) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(parameters.workers, len(order)),
+            initializer=_init_network_worker,
+            initargs=(atlas_df, parameters),
+        ) as executor:
+            tasks = [
+                (
+                    cluster_ids[idx],
+                    compound_tables[idx].rows,
+                    compound_tables[idx].masses,
+                    compound_tables[idx].compound_numbers,
+                    compound_tables[idx].adduct_codes,
+                    compound_tables[idx].id_col,
                 )
+                for idx in order
+            ]
+            # map returns results in task order, so outputs are reproducible
+            for cluster_id, compound_network in zip(
+                (t[0] for t in tasks), executor.map(_network_worker_task, tasks)
+            ):
                 networks[cluster_id] = compound_network
-            print("Finished Atlas annotation for GNPS cluster " + str(cluster_id))
+                print("Finished Atlas annotation for GNPS cluster " + str(cluster_id))
+        return networks
+    for idx in order:
+        cluster_id = cluster_ids[idx]
+        networks[cluster_id] = cluster_compound_network(
+            cluster_id, compound_tables[idx], parameters
+        )
+        print("Finished Atlas annotation for GNPS cluster " + str(cluster_id))
     return networks
+
+
+def cluster_compound_network(
+    cluster_id: int, compound_table: CompoundMatchTable, parameters: Parameters
+) -> CompoundGraph:
+    """Create the compound network for a single GNPS cluster"""
+    compound_network = create_networks.build_compound_graph(compound_table, parameters)
+    compound_network.set_node_attribute("componentindex", cluster_id)
+    return compound_network
+
+
+# Per-process state for process pool workers, set once by the pool initializer
+_worker_state = {}
+
+
+def _init_network_worker(atlas_df: pd.DataFrame, parameters: Parameters):
+    _worker_state["atlas_df"] = atlas_df
+    _worker_state["parameters"] = parameters
+
+
+def _network_worker_task(task) -> CompoundGraph:
+    cluster_id, rows, masses, compound_numbers, adduct_codes, id_col = task
+    parameters = _worker_state["parameters"]
+    compound_table = CompoundMatchTable(
+        atlas_df=_worker_state["atlas_df"],
+        rows=rows,
+        masses=masses,
+        compound_numbers=compound_numbers,
+        adduct_codes=adduct_codes,
+        adduct_list=list(parameters.adduct_list),
+        id_col=id_col,
+    )
+    return cluster_compound_network(cluster_id, compound_table, parameters)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""Compact array-backed compound network used between network creation and export
+
+The post-processing steps (size checks, small subgraph pruning and top candidate annotation) only need the
+connectivity and the compound_group of each node. CompoundGraph holds the edges as a symmetric scipy CSR matrix
+and node attributes as one array per attribute, and is only converted to a networkx graph for GraphML or
+Cytoscape export. All post-processing steps share one ComponentSummary, which is only recomputed after nodes
+are removed.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+
+class CompoundGraph:
+    """Class holding a compound network as a CSR adjacency matrix and node attribute arrays
+
+    Nodes are numbered by array position. node_ids holds the id each node had when the network was created,
+    which is kept through pruning and used as the node id in networkx. node_data holds one array per node
+    attribute, in attribute order.
+    """
+
+    def __init__(
+        self,
+        adjacency: sparse.csr_matrix,
+        node_ids: np.ndarray,
+        node_data: Dict[str, np.ndarray],
+    ):
+        self.adjacency = adjacency
+        self.node_ids = node_ids
+        self.node_data = node_data
+        self._summary: Optional[ComponentSummary] = None
+
+    @classmethod
+    def from_edges(
+        cls, n_nodes: int, edge_list: np.ndarray, node_data: Dict[str, list]
+    ) -> "CompoundGraph":
+        """Create a graph from an (n_edges, 2) array of node positions and attribute value lists"""
+        return cls(
+            _symmetric_adjacency(n_nodes, edge_list),
+            np.arange(n_nodes),
+            {name: _attribute_array(values) for name, values in node_data.items()},
+        )
+
+    @classmethod
+    def from_networkx(cls, G: nx.Graph) -> "CompoundGraph":
+        """Create a graph from a networkx graph whose nodes all have the same attributes"""
+        nodes = list(G.nodes)
+        positions = {node: pos for pos, node in enumerate(nodes)}
+        names = list(G.nodes[nodes[0]]) if nodes else []
+        graph = cls.from_edges(
+            len(nodes),
+            sorted(tuple(sorted((positions[u], positions[v]))) for u, v in G.edges),
+            {name: [G.nodes[node][name] for node in nodes] for name in names},
+        )
+        graph.node_ids = _attribute_array(nodes)
+        return graph
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def number_of_edges(self) -> int:
+        return self.adjacency.nnz // 2
+
+    def edges(self) -> np.ndarray:
+        """(n_edges, 2) array of node positions with the lower position first, in row-major order"""
+        upper = sparse.triu(self.adjacency, k=1).tocoo()
+        order = np.lexsort((upper.col, upper.row))
+        return np.column_stack((upper.row[order], upper.col[order]))
+
+    def with_edges(self, edge_list: np.ndarray) -> "CompoundGraph":
+        """New graph with the same nodes and attributes and the given edges"""
+        return CompoundGraph(
+            _symmetric_adjacency(len(self), edge_list),
+            self.node_ids.copy(),
+            {name: values.copy() for name, values in self.node_data.items()},
+        )
+
+    def set_node_attribute(self, name: str, value: Any) -> None:
+        """Set an attribute to the same value for every node"""
+        self.node_data[name] = _attribute_array([value] * len(self))
+        if name == "compound_group":
+            self._summary = None
+
+    @property
+    def summary(self) -> "ComponentSummary":
+        """Component summary, computed on first use and kept until nodes are removed"""
+        if self._summary is None:
+            self._summary = ComponentSummary.from_edges(
+                len(self), self.edges(), self.node_data.get("compound_group")
+            )
+        return self._summary
+
+    def compound_group_counts(self) -> Dict[int, int]:
+        """Number of distinct compound groups in each connected component, indexed by component label"""
+        return dict(enumerate(self.summary.group_counts.tolist()))
+
+    def size_check(
+        self,
+        min_group_count: int,
+        min_cluster_size: int,
+        max_node_count: int = 2000,
+        max_edge_count: int = 10000,
+    ) -> bool:
+        """Same as create_networks.graph_size_check"""
+        summary = self.summary
+        if not summary.n_components:
+            return False
+        return (
+            summary.group_counts.max() >= min_group_count
+            and min_cluster_size <= len(self) < max_node_count
+            and summary.edge_counts.sum() < max_edge_count
+        )
+
+    def remove_nodes(self, keep: np.ndarray) -> None:
+        """Keep only the nodes where the boolean mask `keep` is True"""
+        if keep.all():
+            return
+        self.adjacency = self.adjacency[keep][:, keep].tocsr()
+        self.node_ids = self.node_ids[keep]
+        self.node_data = {name: values[keep] for name, values in self.node_data.items()}
+        self._summary = None
+
+    def remove_small_subgraphs(self, min_size: int) -> None:
+        """Remove connected components with fewer than min_size nodes"""
+        summary = self.summary
+        keep_components = summary.sizes >= min_size
+        if keep_components.all():
+            return
+        self.remove_nodes(keep_components[summary.labels])
+        # whole components were removed, so the remaining ones are unchanged
+        self._summary = summary.select(keep_components)
+
+    def annotate_top_candidates(self) -> None:
+        """Same as create_networks.annotate_top_candidates, setting the top_candidate node attribute"""
+        summary = self.summary
+        max_group_count = summary.group_counts.max() if summary.n_components else -1
+        top_components = summary.group_counts == max_group_count
+        for idx in np.flatnonzero(top_components).tolist():
+            print(f"Subgraph {idx} is a top candidate")
+        self.node_data["top_candidate"] = top_components[summary.labels]
+
+    def to_networkx(self) -> nx.Graph:
+        """Convert to a networkx graph, with nodes and edges in the order match_compound_network adds them"""
+        graph = nx.Graph()
+        names = list(self.node_data)
+        columns = [self.node_data[name].tolist() for name in names]
+        node_attributes = zip(*columns) if columns else ([()] * len(self))
+        graph.add_nodes_from(
+            (node_id, dict(zip(names, values)))
+            for node_id, values in zip(self.node_ids.tolist(), node_attributes)
+        )
+        graph.add_edges_from(self.node_ids[self.edges()].tolist())
+        return graph
+
+
+@dataclass
+class ComponentSummary:
+    """Connected component statistics of a compound network
+
+    Components are numbered in order of their first node. labels holds the component of each node, and sizes,
+    edge_counts and group_counts (distinct compound groups) hold one value per component.
+    """
+
+    labels: np.ndarray
+    sizes: np.ndarray
+    edge_counts: np.ndarray
+    group_counts: np.ndarray
+
+    @property
+    def n_components(self) -> int:
+        return len(self.sizes)
+
+    @classmethod
+    def from_edges(
+        cls, n_nodes: int, edge_list: np.ndarray, groups: Optional[np.ndarray] = None
+    ) -> "ComponentSummary":
+        """Compute all statistics in one union-find pass over the (n_edges, 2) edge array"""
+        roots = _union_find(n_nodes, edge_list)
+        # every root is the lowest node of its component, so sorted roots give components in first node order
+        component_roots, labels = np.unique(roots, return_inverse=True)
+        n_components = len(component_roots)
+        sizes = np.bincount(labels, minlength=n_components)
+        edge_counts = np.bincount(labels[edge_list[:, 0]], minlength=n_components)
+        group_counts = np.zeros(n_components, dtype=np.int64)
+        if groups is not None:
+            has_group = np.array([g is not None for g in groups.tolist()], dtype=bool)
+            pairs = np.unique(
+                np.column_stack((labels[has_group], _group_codes(groups[has_group]))),
+                axis=0,
+            )
+            group_counts = np.bincount(pairs[:, 0], minlength=n_components)
+        return cls(labels, sizes, edge_counts, group_counts)
+
+    def select(self, keep_components: np.ndarray) -> "ComponentSummary":
+        """Summary after removing every node of the components where keep_components is False"""
+        new_labels = np.cumsum(keep_components) - 1
+        return ComponentSummary(
+            new_labels[self.labels[keep_components[self.labels]]],
+            self.sizes[keep_components],
+            self.edge_counts[keep_components],
+            self.group_counts[keep_components],
+        )
+
+
+def _union_find(n_nodes: int, edge_list: np.ndarray) -> np.ndarray:
+    """Vectorized union-find. Returns the root of each node, which is the lowest node of its component.
+
+    All edges are hooked at once, linking the higher root of each edge to the lower one, then paths are
+    compressed by pointer jumping. Repeats until every edge joins nodes with the same root.
+    """
+    parent = np.arange(n_nodes)
+    u, v = edge_list[:, 0], edge_list[:, 1]
+    while True:
+        root_u, root_v = parent[u], parent[v]
+        linked = root_u != root_v
+        if not linked.any():
+            return parent
+        low = np.minimum(root_u[linked], root_v[linked])
+        high = np.maximum(root_u[linked], root_v[linked])
+        np.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def _symmetric_adjacency(n_nodes: int, edge_list: np.ndarray) -> sparse.csr_matrix:
+    edge_list = np.asarray(edge_list, dtype=np.int64).reshape(-1, 2)
+    upper = sparse.coo_matrix(
+        (np.ones(len(edge_list), dtype=bool), (edge_list[:, 0], edge_list[:, 1])),
+        shape=(n_nodes, n_nodes),
+    )
+    adjacency = (upper + upper.T).tocsr()
+    adjacency.sort_indices()
+    return adjacency
+
+
+def _attribute_array(values: list) -> np.ndarray:
+    """Numeric and boolean attributes become typed arrays, everything else an object array"""
+    array = np.asarray(values)
+    if array.dtype.kind in "biuf":
+        return array
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _group_codes(groups: np.ndarray) -> np.ndarray:
+    codes = {}
+    return np.array(
+        [codes.setdefault(g, len(codes)) for g in groups.tolist()], dtype=np.int64
+    )
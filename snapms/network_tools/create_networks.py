@@ -3,123 +3,376 @@
 """Tools to create networks of various types for SNAP-MS platform"""
 import zipfile
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple, Union
 
 import networkx as nx
+import numpy as np
 from rdkit import Chem, DataStructs
 from rdkit.Chem import AllChem
-
-from snapms.config import CYTOSCAPE_DATADIR, AtlasFilter, Parameters
-from snapms.matching_tools.CompoundMatch import CompoundMatch
+from scipy import sparse
+
+from snapms.atlas_tools.adducts import adduct_labels
+from snapms.atlas_tools.fingerprint_store import FingerprintStore, get_fingerprint_store
+from snapms.atlas_tools.neighbour_graph import NeighbourGraph, get_neighbour_graph
+from snapms.config import CYTOSCAPE_DATADIR, AtlasFilter, Parameters, SimilarityEngine
+from snapms.matching_tools.CompoundMatch import (
+    COCONUT_URL,
+    NPATLAS_URL,
+    CompoundMatchTable,
+)
+from snapms.network_tools import bit_similarity
 from snapms.network_tools import cytoscape as cy
+from snapms.network_tools import similarity_tiles
+from snapms.network_tools.compound_graph import CompoundGraph
 
 
 def tanimoto_matrix(smiles_list: List[str]) -> List[List[float]]:
     """Creates square matrix of Tanimoto scores for all SMILES strings in the input list"""
-    fingerprints = [
+    return similarity_matrix(smiles_list).tolist()
+
+
+def similarity_matrix(
+    smiles_list: List[str], cutoff: Optional[float] = None
+) -> np.ndarray:
+    """Creates square numpy matrix of Dice similarity scores for all SMILES strings in the input list
+
+    Candidate lists often repeat the same structure (e.g. one compound matching several adducts), so fingerprints
+    and similarity rows are only computed once per unique SMILES and expanded back to the input positions.
+    With a cutoff, pairs that cannot reach it are left at 0 (see dice_matrix).
+    """
+    unique_smiles, inverse = unique_inverse(smiles_list)
+    matrix = dice_matrix(morgan_fingerprints(unique_smiles), cutoff)
+    if len(unique_smiles) == len(smiles_list):
+        return matrix
+    return matrix[np.ix_(inverse, inverse)]
+
+
+def packed_similarity_matrix(
+    smiles_list: List[str], cutoff: Optional[float] = None
+) -> np.ndarray:
+    """Same as similarity_matrix, using the bit-packed engine. Returns a float32 matrix."""
+    unique_smiles, inverse = unique_inverse(smiles_list)
+    matrix = bit_similarity.dice_matrix(
+        bit_similarity.packed_fingerprints(unique_smiles), cutoff
+    )
+    if len(unique_smiles) == len(smiles_list):
+        return matrix
+    return matrix[np.ix_(inverse, inverse)]
+
+
+def stored_similarity_matrix(
+    compound_matches: CompoundMatchTable,
+    store: FingerprintStore,
+    cutoff: Optional[float] = None,
+) -> np.ndarray:
+    """Same as similarity_matrix, but with fingerprints looked up by Atlas row id in the precomputed store"""
+    fingerprints, inverse = stored_fingerprints(compound_matches, store)
+    return dice_matrix(fingerprints, cutoff)[np.ix_(inverse, inverse)]
+
+
+def stored_fingerprints(
+    compound_matches: CompoundMatchTable, store: FingerprintStore
+) -> Tuple[List, np.ndarray]:
+    """Fingerprints of the unique Atlas rows in the match table, and the unique position of each match"""
+    unique_ids, inverse = np.unique(compound_matches.row_ids, return_inverse=True)
+    fingerprints = store.fingerprints(unique_ids.tolist())
+    if any(fp is None for fp in fingerprints):
+        # not fingerprinted at build time, recompute from SMILES
+        smiles = compound_matches.atlas_df["smiles"].loc[unique_ids].to_list()
+        fingerprints = [
+            fp if fp is not None else morgan_fingerprints([s])[0]
+            for fp, s in zip(fingerprints, smiles)
+        ]
+    return fingerprints, inverse
+
+
+def morgan_fingerprints(smiles_list: List[str]) -> List:
+    """Morgan radius 2 count fingerprints for each SMILES string"""
+    return [
         AllChem.GetMorganFingerprint(Chem.MolFromSmiles(compound), 2)
         for compound in smiles_list
     ]
-    matrix = [DataStructs.BulkDiceSimilarity(fp, fingerprints) for fp in fingerprints]
 
+
+def dice_matrix(fingerprints: List, cutoff: Optional[float] = None) -> np.ndarray:
+    """Square matrix of Dice similarity scores between all fingerprints
+
+    With a cutoff, only pairs within the popcount bound of similarity_tiles.popcount_bounds are scored and all
+    other pairs, which cannot reach the cutoff, are left at 0. Use it only when thresholding at that cutoff.
+    """
+    if cutoff is None:
+        matrix = np.empty((len(fingerprints), len(fingerprints)), dtype=np.float64)
+        for idx, fp in enumerate(fingerprints):
+            matrix[idx] = DataStructs.BulkDiceSimilarity(fp, fingerprints)
+        return matrix
+    matrix = np.zeros((len(fingerprints), len(fingerprints)), dtype=np.float64)
+    order, stops = similarity_tiles.popcount_bounds(
+        similarity_tiles.rdkit_counts(fingerprints), cutoff
+    )
+    sorted_fingerprints = [fingerprints[i] for i in order]
+    for position, row in enumerate(order):
+        partners = order[position : stops[position]]
+        scores = DataStructs.BulkDiceSimilarity(
+            sorted_fingerprints[position],
+            sorted_fingerprints[position : stops[position]],
+        )
+        matrix[row, partners] = scores
+        matrix[partners, row] = scores
     return matrix
 
 
+def unique_inverse(values: List) -> Tuple[List, np.ndarray]:
+    """Unique values in order of first occurrence, and the position of each input value in the unique list"""
+    positions = {}
+    inverse = np.array(
+        [positions.setdefault(v, len(positions)) for v in values], dtype=np.int64
+    )
+    return list(positions), inverse
+
+
+def similarity_edges(
+    matrix: np.ndarray, compound_groups: np.ndarray, cutoff: float
+) -> np.ndarray:
+    """Select edges from a similarity matrix in one vectorized step.
+
+    Keeps pairs at or above the cutoff, in the upper triangle only, and not between compounds in the same compound
+    group. Returns an (n_edges, 2) array of node index pairs in row-major order.
+    """
+    compound_groups = np.asarray(compound_groups)
+    mask = np.triu(matrix >= cutoff, k=1)
+    mask &= compound_groups[:, None] != compound_groups[None, :]
+    return np.argwhere(mask)
+
+
+def adjacency_edges(
+    adjacency: sparse.spmatrix, compound_groups: np.ndarray
+) -> np.ndarray:
+    """Select edges from a sparse adjacency matrix with the same rules as similarity_edges.
+    Returns an (n_edges, 2) array of node index pairs in row-major order.
+    """
+    compound_groups = np.asarray(compound_groups)
+    adjacency = adjacency.tocoo()
+    mask = (adjacency.row < adjacency.col) & (
+        compound_groups[adjacency.row] != compound_groups[adjacency.col]
+    )
+    edges = np.column_stack((adjacency.row[mask], adjacency.col[mask]))
+    return edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+
+def covering_neighbour_graph(
+    compound_matches: CompoundMatchTable, parameters: Parameters, cutoff: float
+) -> Optional[NeighbourGraph]:
+    """Precomputed Atlas neighbour graph if it holds every edge between the candidates at `cutoff`, else None"""
+    # The precomputed Atlas neighbour graph holds scores from the default RDKit engine
+    if parameters.similarity_engine != SimilarityEngine.rdkit:
+        return None
+    neighbour_graph = get_neighbour_graph(parameters)
+    if neighbour_graph is None or not neighbour_graph.covers(
+        compound_matches.row_ids, cutoff
+    ):
+        return None
+    return neighbour_graph
+
+
+def candidate_fingerprint_store(
+    compound_matches: CompoundMatchTable, parameters: Parameters
+) -> Optional[FingerprintStore]:
+    """Precomputed fingerprint store if it holds the candidates of the RDKit engine, else None"""
+    if parameters.similarity_engine != SimilarityEngine.rdkit:
+        return None
+    store = get_fingerprint_store(parameters)
+    if store is None or compound_matches.atlas_df.index.max() >= len(store):
+        return None
+    return store
+
+
+def compound_similarity_edges(
+    compound_matches: CompoundMatchTable, parameters: Parameters, cutoff: float
+) -> np.ndarray:
+    """Compute the network edges between all candidates in a match table.
+
+    Clusters whose dense similarity matrix fits in `parameters.similarity_memory` are scored as one matrix, unless
+    every edge is already known from the precomputed Atlas neighbour graph. All other clusters go through
+    CandidateSimilarity, which scores them blockwise in tiles keeping only the pairs at or above the cutoff, which
+    gives the same edges.
+    """
+    smiles_list = compound_matches.column("smiles").tolist()
+    compound_groups = compound_matches.compound_numbers
+    if (
+        len(smiles_list) ** 2 * 8 <= parameters.similarity_memory
+        and covering_neighbour_graph(compound_matches, parameters, cutoff) is None
+    ):
+        store = candidate_fingerprint_store(compound_matches, parameters)
+        if parameters.similarity_engine == SimilarityEngine.bitpacked:
+            matrix = packed_similarity_matrix(smiles_list, cutoff)
+        elif store is not None:
+            matrix = stored_similarity_matrix(compound_matches, store, cutoff)
+        else:
+            matrix = similarity_matrix(smiles_list, cutoff)
+        return similarity_edges(matrix, compound_groups, cutoff)
+    similarity = CandidateSimilarity.from_matches(compound_matches, parameters, cutoff)
+    return similarity.edges(cutoff, compound_groups)
+
+
+class CandidateSimilarity:
+    """Similarity pairs between the unique structures of a match table at or above a minimum cutoff
+
+    Computed once per match table, then reused for the edges at any cutoff >= min_cutoff and for any subset of
+    the matches, as in parameter sweeps. pairs holds (rows, cols, scores) between unique structures with
+    cols >= rows, and inverse the unique structure of each match.
+    """
+
+    def __init__(
+        self, pairs: similarity_tiles.Pairs, inverse: np.ndarray, min_cutoff: float
+    ):
+        self.pairs = pairs
+        self.inverse = inverse
+        self.min_cutoff = min_cutoff
+
+    @property
+    def n_unique(self) -> int:
+        return int(self.inverse.max()) + 1 if len(self.inverse) else 0
+
+    @classmethod
+    def from_matches(
+        cls,
+        compound_matches: CompoundMatchTable,
+        parameters: Parameters,
+        min_cutoff: float,
+    ) -> "CandidateSimilarity":
+        """Take the pairs from the neighbour graph if it covers the candidates. Otherwise score them in tiles under
+        the `parameters.similarity_memory` budget, on `parameters.similarity_threads` threads for the bitpacked engine.
+        """
+        neighbour_graph = covering_neighbour_graph(
+            compound_matches, parameters, min_cutoff
+        )
+        if neighbour_graph is not None:
+            unique_ids, inverse = np.unique(
+                compound_matches.row_ids, return_inverse=True
+            )
+            return cls(
+                neighbour_graph.pairs(unique_ids, min_cutoff), inverse, min_cutoff
+            )
+        if parameters.similarity_engine == SimilarityEngine.bitpacked:
+            unique_smiles, inverse = unique_inverse(
+                compound_matches.column("smiles").tolist()
+            )
+            pairs = bit_similarity.dice_pairs(
+                bit_similarity.packed_fingerprints(unique_smiles),
+                min_cutoff,
+                parameters.similarity_memory,
+                parameters.similarity_threads,
+            )
+            return cls(pairs, inverse, min_cutoff)
+        store = candidate_fingerprint_store(compound_matches, parameters)
+        if store is not None:
+            fingerprints, inverse = stored_fingerprints(compound_matches, store)
+        else:
+            unique_smiles, inverse = unique_inverse(
+                compound_matches.column("smiles").tolist()
+            )
+            fingerprints = morgan_fingerprints(unique_smiles)
+        pairs = similarity_tiles.pruned_rdkit_pairs(
+            fingerprints, min_cutoff, parameters.similarity_memory
+        )
+        return cls(pairs, inverse, min_cutoff)
+
+    def edges(
+        self,
+        cutoff: float,
+        compound_groups: np.ndarray,
+        positions: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Network edges at `cutoff` between the matches at `positions` (all matches if None).
+        Edge node indices count within the selected matches, as in match_compound_network.
+        """
+        if cutoff < self.min_cutoff:
+            raise ValueError(
+                f"Similarity cutoff {cutoff} is below the computed minimum {self.min_cutoff}"
+            )
+        inverse = self.inverse if positions is None else self.inverse[positions]
+        rows, cols, scores = self.pairs
+        keep = scores >= cutoff
+        adjacency = similarity_tiles.pairs_adjacency(
+            (rows[keep], cols[keep], scores[keep]), self.n_unique
+        )
+        return adjacency_edges(
+            similarity_tiles.expand_adjacency(adjacency, inverse), compound_groups
+        )
+
+
 def match_compound_network(
-    compound_match_list: List[CompoundMatch], parameters: Parameters
+    compound_matches: CompoundMatchTable,
+    parameters: Parameters,
+    edge_list: Optional[np.ndarray] = None,
 ) -> nx.Graph:
     """Tool to create a network illustrating relatedness of candidate structures for masses in a GNPS cluster
-    Requires the output list from matching_tools.match_compounds.return_compounds
+    Requires the output table from matching_tools.match_compounds.compute_adduct_matches
+    edge_list optionally gives precomputed edges (e.g. from CandidateSimilarity), skipping the similarity search
     """
+    return build_compound_graph(compound_matches, parameters, edge_list).to_networkx()
 
-    # Similarity score required to create an edge in the network graph
-    tanimoto_cutoff = 0.66
 
-    # Create a list of just the SMILES strings, for the Tanimoto grid generation
-    smiles_list = [c.smiles for c in compound_match_list]
+def build_compound_graph(
+    compound_matches: CompoundMatchTable,
+    parameters: Parameters,
+    edge_list: Optional[np.ndarray] = None,
+) -> CompoundGraph:
+    """Array-backed version of match_compound_network, used by the SNAP-MS pipeline until export"""
 
-    tanimoto_grid = tanimoto_matrix(smiles_list)
+    # Similarity score required to create an edge in the network graph
+    tanimoto_cutoff = parameters.similarity_cutoff
 
-    # Create network graph
-    compound_graph = nx.Graph()
+    # Create a list of just the SMILES strings, for the Tanimoto grid generation
+    smiles_list = compound_matches.column("smiles").tolist()
 
-    # Add compound nodes. index_group_dict indicates which compound group each compound derives from.
+    # Add compound nodes. compound_group indicates which compound group each compound derives from.
     # Used to prevent inclusion of edges between compounds from the same group
     # (i.e. candidates for the same original mass)
-    node_list = []
-    adduct_dict = {
-        "m_plus_h": "[M+H]+",
-        "m_plus_na": "[M+Na]+",
-        "m_plus_nh4": "[M+NH4]+",
-        "m_plus_h_minus_h2o": "[M-H2O+H]+",
-        "m_plus_k": "[M+K]+",
-        "2m_plus_h": "[2M+H]+",
-        "2m_plus_na": "[2M+Na]+",
-    }
-    index_group_dict = {}
-    for index, compound in enumerate(compound_match_list):
-        if parameters.atlas_filter == AtlasFilter.coconut:
-            node_list.append(
-                (
-                    index,
-                    {
-                        "coconut_id": compound.coconut_id,
-                        "exact_mass": compound.exact_mass,
-                        "smiles": compound.smiles,
-                        "compound_name": compound.friendly_name(),
-                        "coconut_url": compound.coconut_url,
-                        "original_gnps_mass": compound.mass,
-                        "compound_group": compound.compound_number,
-                        "adduct": adduct_dict[compound.adduct],
-                        "origin_organism_type": "Unknown",
-                    },
-                )
-            )
-        elif parameters.atlas_filter in [
-            AtlasFilter.full,
-            AtlasFilter.bacteria,
-            AtlasFilter.fungi,
-            AtlasFilter.custom,
-        ]:
-            node_list.append(
-                (
-                    index,
-                    {
-                        "npaid": compound.npaid,
-                        "exact_mass": compound.exact_mass,
-                        "smiles": compound.smiles,
-                        "compound_name": compound.friendly_name(),
-                        "npatlas_url": compound.npatlas_url,
-                        "original_gnps_mass": compound.mass,
-                        "compound_group": compound.compound_number,
-                        "adduct": adduct_dict[compound.adduct],
-                        "origin_organism_type": compound.origin_organism_type,
-                    },
-                )
-            )
-        else:
-            print("ERROR: atlas_filter not found")
-        index_group_dict[index] = compound.compound_number
-    compound_graph.add_nodes_from(node_list)
-
+    compound_numbers = compound_matches.compound_numbers.tolist()
+    if parameters.atlas_filter == AtlasFilter.coconut:
+        id_col, url_col, url_template = "coconut_id", "coconut_url", COCONUT_URL
+        organism_types = ["Unknown"] * len(compound_matches)
+    elif parameters.atlas_filter in [
+        AtlasFilter.full,
+        AtlasFilter.bacteria,
+        AtlasFilter.fungi,
+        AtlasFilter.custom,
+    ]:
+        id_col, url_col, url_template = "npaid", "npatlas_url", NPATLAS_URL
+        organism_types = compound_matches.column("origin_organism_type").tolist()
+    else:
+        print("ERROR: atlas_filter not found")
+        id_col = None
+    # Node attributes are built column-wise from the match table and only zipped into dicts for networkx
+    node_columns = {}
+    if id_col is not None:
+        ids = compound_matches.column(id_col).tolist()
+        node_columns = {
+            id_col: ids,
+            "exact_mass": compound_matches.column("exact_mass").tolist(),
+            "smiles": smiles_list,
+            "compound_name": compound_matches.display_names(),
+            url_col: [url_template.format(i) for i in ids],
+            "original_gnps_mass": compound_matches.masses.tolist(),
+            "compound_group": compound_numbers,
+            "adduct": np.array(
+                adduct_labels(compound_matches.adduct_list), dtype=object
+            )[compound_matches.adduct_codes].tolist(),
+            "origin_organism_type": organism_types,
+        }
     # Add edges if above Dice threshold and not between compounds in the same compound group
     # (i.e. compounds that are included because they are candidates for the same original mass from GNPS)
-    edge_list = []
-    for row_idx, row in enumerate(tanimoto_grid):
-        for col_idx, value in enumerate(row):
-            if row_idx == col_idx:
-                continue
-            if (
-                value >= tanimoto_cutoff
-                and index_group_dict[row_idx] != index_group_dict[col_idx]
-            ):
-                edge_list.append((row_idx, col_idx))
-    compound_graph.add_edges_from(edge_list)
-
-    return compound_graph
-
-
-def export_graphml(graph: nx.Graph, parameters: Parameters, output_path: Path):
+    if edge_list is None:
+        edge_list = compound_similarity_edges(
+            compound_matches, parameters, tanimoto_cutoff
+        )
+    return CompoundGraph.from_edges(len(compound_matches), edge_list, node_columns)
+
+
+def export_graphml(
+    graph: Union[nx.Graph, CompoundGraph], parameters: Parameters, output_path: Path
+):
     """Exports networkx graph from match_compound_network as graphML for use in external visualization tools"""
     if graph_size_check(
         graph,
@@ -128,6 +381,8 @@ def export_graphml(graph: nx.Graph, parameters: Parameters, output_path: Path):
         parameters.max_node_count,
         parameters.max_edge_count,
     ):
+        if isinstance(graph, CompoundGraph):
+            graph = graph.to_networkx()
         nx.write_graphml(graph, output_path)
     else:
         print(
@@ -150,16 +405,20 @@ def compress_gnps_graphml_outputs(parameters: Parameters):
 
 
 def insert_atlas_clusters_to_cytoscape(
-    original_gnps_graph, filtered_networks: Dict[int, nx.Graph], parameters: Parameters
+    original_gnps_graph: Optional[nx.Graph],
+    filtered_networks: Dict[int, Union[nx.Graph, CompoundGraph]],
+    parameters: Parameters,
 ):
     """Tool to create a new collection in an existing Cytoscape file, and to append all Atlas GNPS annotation networks
     as separate network views.
 
-    Networks should be pre-filtered for size and annotated with top candidates already.
+    Networks should be pre-filtered for size and annotated with top candidates already. original_gnps_graph is
+    None for GNPS node table inputs, which have no network to add.
     """
     # Import original gnps network (currently not implemented)
-    print("Adding original GNPS network to Cytoscape file")
-    add_original_gnps_graph_to_cytoscape(original_gnps_graph, "Original_GNPS_graph")
+    if original_gnps_graph is not None:
+        print("Adding original GNPS network to Cytoscape file")
+        add_original_gnps_graph_to_cytoscape(original_gnps_graph, "Original_GNPS_graph")
     # Open each Atlas annotation network in turn. Glob function includes [0-9] in order to exclude the modified original
     # gnps network (if present)
 
@@ -186,10 +445,13 @@ def insert_atlas_clusters_to_cytoscape(
     cy.cyrest_delete_session()
 
 
-def remove_small_subgraphs(G: nx.Graph, parameters: Parameters):
+def remove_small_subgraphs(G: Union[nx.Graph, CompoundGraph], parameters: Parameters):
     """Remove subgraphs that do not have the minimum required number of nodes. Useful for removing large
     numbers of small clusters containing just one or two Atlas compounds
     """
+    if isinstance(G, CompoundGraph):
+        G.remove_small_subgraphs(parameters.min_atlas_annotation_cluster_size)
+        return
     nodes_to_include = set()
     for subgraph in nx.connected_components(G):
         if len(subgraph) >= parameters.min_atlas_annotation_cluster_size:
@@ -198,11 +460,13 @@ def remove_small_subgraphs(G: nx.Graph, parameters: Parameters):
     G.remove_nodes_from(nodes_to_remove)
 
 
-def add_cluster_to_cytoscape(G: nx.Graph, title: str) -> None:
+def add_cluster_to_cytoscape(G: Union[nx.Graph, CompoundGraph], title: str) -> None:
     """Add graph to cytoscape session and applying styling.
 
     IMPORTANT: Assumes CyREST is available.
     """
+    if isinstance(G, CompoundGraph):
+        G = G.to_networkx()
     add_chemviz_passthrough_column(G)
     # Insert Atlas annotation graph to Cytoscape file
     network_id = cy.networkx_to_cyrest(G, name=title)
@@ -233,7 +497,7 @@ def extract_cluster_id(filepath: Path) -> int:
 
 
 def graph_size_check(
-    G: nx.Graph,
+    G: Union[nx.Graph, CompoundGraph],
     min_group_count: int,
     min_cluster_size: int,
     max_node_count: int = 2000,
@@ -245,6 +509,10 @@ def graph_size_check(
     """
     # Assess the results graph to make sure that at least one subgraph contains the minimum number of compound groups
     # and that the nodes and edges do not violate max limits
+    if isinstance(G, CompoundGraph):
+        return G.size_check(
+            min_group_count, min_cluster_size, max_node_count, max_edge_count
+        )
     group_counts = get_compound_group_count(G)
 
     try:
@@ -274,11 +542,13 @@ def compound_group_counter(G: nx.Graph) -> int:
     return len(compound_groups)
 
 
-def get_compound_group_count(G: nx.Graph) -> Dict[int, int]:
+def get_compound_group_count(G: Union[nx.Graph, CompoundGraph]) -> Dict[int, int]:
     """Compute the compound group count in any subgraph in the main graph.
 
     Returns a dictionary with subgraph index key and count value
     """
+    if isinstance(G, CompoundGraph):
+        return G.compound_group_counts()
     counts = {}
     for idx, subgraph in enumerate(nx.connected_components(G)):
         S = G.subgraph(subgraph)
@@ -286,11 +556,14 @@ def get_compound_group_count(G: nx.Graph) -> Dict[int, int]:
     return counts
 
 
-def annotate_top_candidates(G: nx.Graph) -> None:
+def annotate_top_candidates(G: Union[nx.Graph, CompoundGraph]) -> None:
     """Annotate subgraphs as top candidate answers, based on maximum compound group counts within each subgraph
     in the network. In other words, if three answers all have four compound groups and this is the highest compound
     group count, then these three answers are all equally likely to be correct.
     """
+    if isinstance(G, CompoundGraph):
+        G.annotate_top_candidates()
+        return
     group_counts = get_compound_group_count(G)
 
     # globally set top_candidate attribute to False
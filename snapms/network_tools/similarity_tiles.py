@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Memory-bounded blockwise similarity computation
+
+The full candidate x candidate similarity matrix is never held in memory. Rows are split into tiles sized so that
+the scores of the tiles being worked on fit in a memory budget, and each tile only keeps the pairs at or above the
+cutoff. Peak memory is set by the tile size rather than by n².
+
+Tiles can be scored on a thread pool, which only helps scorers that release the GIL such as the numpy engine (see
+bit_similarity). RDKit `BulkDiceSimilarity` holds the GIL for the whole call, so RDKit tiles are scored serially.
+
+A tile scorer takes the `start` and `stop` rows of a tile and returns the (rows, cols, scores) of the pairs in
+those rows at or above the cutoff, for cols >= rows only, in row-major order.
+
+Before scoring, rows can be sorted by fingerprint popcount (see popcount_bounds). For popcounts a <= b the Dice
+similarity is at most 2a / (a + b), so each sorted row only has to be compared against the following rows up to
+popcount a (2 - t) / t for a cutoff t. Pairs beyond that range cannot reach the cutoff and are never scored.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from rdkit import DataStructs
+from scipy import sparse
+
+from snapms.config import DEFAULT_SIMILARITY_MEMORY
+
+Pairs = Tuple[np.ndarray, np.ndarray, np.ndarray]
+TileScorer = Callable[[int, int], Pairs]
+
+# Relative slack on the popcount bound so float rounding never prunes a pair that reaches the cutoff
+BOUND_TOLERANCE = 1e-6
+# Bytes of RDKit tile temporaries per scored pair: the list of Python floats returned by BulkDiceSimilarity
+# (8 byte pointer and 24 byte float object), its float64 array copy and the cutoff mask
+RDKIT_PAIR_BYTES = 8 + 24 + 8 + 1
+
+
+def tile_bounds(
+    n_rows: int, bytes_per_row: int, memory_budget: int, threads: int = 1
+) -> List[Tuple[int, int]]:
+    """Split rows into (start, stop) tiles so that one tile per thread fits in the memory budget"""
+    tile_rows = max(1, memory_budget // max(1, bytes_per_row * threads))
+    return [
+        (start, min(start + tile_rows, n_rows)) for start in range(0, n_rows, tile_rows)
+    ]
+
+
+def blockwise_pairs(
+    n_rows: int,
+    score_tile: TileScorer,
+    bytes_per_row: int,
+    memory_budget: int = DEFAULT_SIMILARITY_MEMORY,
+    threads: int = 1,
+) -> Pairs:
+    """Score all tiles and concatenate the above-cutoff pairs, in row-major order"""
+    bounds = tile_bounds(n_rows, bytes_per_row, memory_budget, threads)
+    if threads > 1 and len(bounds) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            tiles = list(pool.map(lambda b: score_tile(*b), bounds))
+    else:
+        tiles = [score_tile(*b) for b in bounds]
+    if not tiles:
+        return empty_pairs()
+    rows, cols, scores = zip(*tiles)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+
+def empty_pairs() -> Pairs:
+    return (
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.float64),
+    )
+
+
+def popcount_bounds(counts: np.ndarray, cutoff: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort rows by popcount. Returns the sort order and, for each sorted row, the end (exclusive) of the
+    range of sorted rows that can reach the cutoff with it.
+    """
+    counts = np.asarray(counts)
+    order = np.argsort(counts, kind="stable")
+    if cutoff <= 0:
+        return order, np.full(len(counts), len(counts), dtype=np.int64)
+    sorted_counts = counts[order]
+    limits = sorted_counts * ((2 - cutoff) / cutoff) * (1 + BOUND_TOLERANCE)
+    stops = np.searchsorted(sorted_counts, limits, side="right")
+    # every row is at least compared against itself
+    return order, np.maximum(stops, np.arange(1, len(counts) + 1))
+
+
+def restore_order(pairs: Pairs, order: np.ndarray) -> Pairs:
+    """Map pairs between popcount sorted rows back to the input rows, with rows <= cols in row-major order"""
+    rows, cols, scores = pairs
+    rows, cols = order[rows], order[cols]
+    rows, cols = np.minimum(rows, cols), np.maximum(rows, cols)
+    sort = np.lexsort((cols, rows))
+    return rows[sort], cols[sort], scores[sort]
+
+
+def rdkit_counts(fingerprints: Sequence) -> np.ndarray:
+    """Total feature count of each RDKit count fingerprint, the popcount used for its Dice bound"""
+    return np.array([fp.GetTotalVal() for fp in fingerprints], dtype=np.int64)
+
+
+def rdkit_dice_tiles(
+    fingerprints: Sequence, cutoff: float, stops: Optional[np.ndarray] = None
+) -> TileScorer:
+    """Tile scorer for RDKit fingerprints, comparing each row against itself and all later rows.
+    With popcount sorted fingerprints, `stops` from popcount_bounds limits the later rows compared.
+    """
+
+    def score_tile(start: int, stop: int) -> Pairs:
+        rows = []
+        cols = []
+        scores = []
+        for row in range(start, stop):
+            partners = (
+                fingerprints[row : stops[row]]
+                if stops is not None
+                else fingerprints[row:]
+            )
+            row_scores = np.array(
+                DataStructs.BulkDiceSimilarity(fingerprints[row], partners)
+            )
+            hits = np.flatnonzero(row_scores >= cutoff)
+            rows.append(np.full(len(hits), row, dtype=np.int64))
+            cols.append(row + hits)
+            scores.append(row_scores[hits])
+        if not rows:
+            return empty_pairs()
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+    return score_tile
+
+
+def pruned_rdkit_pairs(
+    fingerprints: Sequence,
+    cutoff: float,
+    memory_budget: int = DEFAULT_SIMILARITY_MEMORY,
+) -> Pairs:
+    """Blockwise (rows, cols, scores) of all RDKit fingerprint pairs with cols >= rows at or above the cutoff,
+    skipping the pairs ruled out by their popcounts. Tiles are scored serially, as RDKit holds the GIL.
+    """
+    order, stops = popcount_bounds(rdkit_counts(fingerprints), cutoff)
+    sorted_fingerprints = [fingerprints[i] for i in order]
+    pairs = blockwise_pairs(
+        len(fingerprints),
+        rdkit_dice_tiles(sorted_fingerprints, cutoff, stops),
+        bytes_per_row=RDKIT_PAIR_BYTES * len(fingerprints),
+        memory_budget=memory_budget,
+    )
+    return restore_order(pairs, order)
+
+
+def pairs_adjacency(pairs: Pairs, n_rows: int) -> sparse.csr_matrix:
+    """Symmetric int8 adjacency matrix from upper triangle pairs"""
+    rows, cols, _ = pairs
+    upper = sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_rows, n_rows)
+    )
+    return (upper + sparse.triu(upper, k=1).T).tocsr()
+
+
+def expand_adjacency(
+    adjacency: sparse.spmatrix, inverse: np.ndarray
+) -> sparse.csr_matrix:
+    """Expand an adjacency matrix between unique entries back to one row per input position,
+    where `inverse` holds the unique entry of each input position
+    """
+    expand = sparse.csr_matrix(
+        (
+            np.ones(len(inverse), dtype=np.int8),
+            (np.arange(len(inverse)), inverse),
+        ),
+        shape=(len(inverse), adjacency.shape[0]),
+    )
+    return (expand @ adjacency @ expand.T).tocsr()
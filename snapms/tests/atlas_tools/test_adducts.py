@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from snapms.atlas_tools import adducts, atlas_import
+from snapms.config import DEFAULT_ADDUCT_LIST
+from snapms.exceptions import AdductNotFound
+
+EXACT_MASSES = np.array([18.010564683, 21.059762, 30.0469501914, 419.1369])
+
+
+def test_adduct_matrix_matches_adduct_compute():
+    matrix = adducts.adduct_matrix(EXACT_MASSES, DEFAULT_ADDUCT_LIST)
+    assert matrix.shape == (len(EXACT_MASSES), len(DEFAULT_ADDUCT_LIST))
+    for position, name in enumerate(DEFAULT_ADDUCT_LIST):
+        assert np.array_equal(
+            matrix[:, position], atlas_import.adduct_compute(EXACT_MASSES, name)
+        )
+
+
+def test_negative_and_multiply_charged_adducts():
+    matrix = adducts.adduct_matrix(
+        EXACT_MASSES,
+        ["m_minus_h", "2m_minus_h", "m_plus_2h", "m_minus_2h", "m_minus_h_minus_h2o"],
+    )
+    assert matrix[:, 0] == pytest.approx(EXACT_MASSES - 1.007276)
+    assert matrix[:, 1] == pytest.approx(2 * EXACT_MASSES - 1.007276)
+    assert matrix[:, 2] == pytest.approx(EXACT_MASSES / 2 + 1.007276)
+    assert matrix[:, 3] == pytest.approx(EXACT_MASSES / 2 - 1.007276)
+    assert matrix[:, 4] == pytest.approx(
+        EXACT_MASSES - 18.010565 - 1.007276, rel=0, abs=1e-6
+    )
+    assert adducts.adduct_labels(["m_minus_h", "m_plus_2h"]) == ["[M-H]-", "[M+2H]2+"]
+
+
+def test_unknown_adduct():
+    with pytest.raises(AdductNotFound):
+        adducts.adduct_matrix(EXACT_MASSES, ["m_plus_h", "3m_plus_fake"])
+
+
+def test_extra_adduct_file(tmp_path):
+    extra_file = tmp_path / "adducts.tsv"
+    extra_file.write_text(
+        "name\tmultiplier\tmass_shift\tcharge\tlabel\n"
+        "m_plus_li\t1\t7.015455\t1\t[M+Li]+\n"
+        "m_plus_k\t1\t38.9637\t1\t[M+K]+ (custom)\n"
+    )
+    registry = adducts._registry(str(extra_file))
+    assert registry["m_plus_li"].mass(100.0) == pytest.approx(107.015455)
+    assert registry["m_plus_k"].label == "[M+K]+ (custom)"
+    assert registry["m_plus_h"] == adducts.adduct_registry()["m_plus_h"]
+    assert "m_plus_li" not in adducts.adduct_registry()
+
+
+def test_extend_adducts_computes_missing_precomputed():
+    df = pd.DataFrame({"exact_mass": EXACT_MASSES, "m_plus_na": [1.0, 2.0, 3.0, 4.0]})
+    atlas_import.extend_adducts(df, ["m_plus_h", "m_plus_na", "m_minus_h"])
+    assert df["m_plus_h"].to_numpy() == pytest.approx(EXACT_MASSES + 1.007276)
+    assert df["m_plus_na"].to_list() == [1.0, 2.0, 3.0, 4.0]
+    assert df["m_minus_h"].to_numpy() == pytest.approx(EXACT_MASSES - 1.007276)
+
+
+def test_atlas_adduct_matrix_matches_extended_columns():
+    adduct_list = ["m_plus_h", "m_plus_na", "m_minus_h"]
+    df = pd.DataFrame({"exact_mass": EXACT_MASSES, "m_plus_na": [1.0, 2.0, 3.0, 4.0]})
+    matrix = atlas_import.atlas_adduct_matrix(df, adduct_list)
+    atlas_import.extend_adducts(df, adduct_list)
+    assert np.array_equal(matrix, df[adduct_list].to_numpy())
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from snapms.atlas_tools import atlas_cache, atlas_import
+from snapms.config import AtlasFilter
+
+
+def test_import_atlas_writes_cache(cached_params):
+    atlas_import.import_atlas(cached_params)
+    assert atlas_cache.atlas_cache_path(cached_params).exists()
+    assert atlas_cache.atlas_cache_path(cached_params).parent == (
+        cached_params.reference_db.parent / "snapms_cache"
+    )
+
+
+def test_import_atlas_cache_roundtrip(cached_params):
+    expected = atlas_import.import_atlas(cached_params)
+    actual = atlas_cache.load_atlas(cached_params)
+    assert_frame_equal(expected, actual)
+    assert_frame_equal(expected, atlas_import.import_atlas(cached_params))
+    assert "display_name" in actual
+
+
+def test_import_atlas_cache_keeps_used_columns(cached_params):
+    actual = atlas_import.import_atlas(cached_params)
+    assert set(actual.columns) <= {
+        *atlas_import.CACHED_COLUMNS,
+        *cached_params.adduct_list,
+    }
+    assert "origin_organism_taxon_ancestors" not in actual
+    # strings are categoricals, so no cached array is pickled
+    assert actual["smiles"].dtype == "category"
+    meta = np.load(atlas_cache.atlas_cache_path(cached_params) / "__meta__.npy")
+    for name in atlas_cache.array_names(meta):
+        fpath = atlas_cache.atlas_cache_path(cached_params) / f"{name}.npy"
+        assert np.load(fpath, allow_pickle=False).dtype != object
+
+
+def test_dataframe_to_arrays_rejects_object_columns():
+    with pytest.raises(ValueError):
+        atlas_cache.dataframe_to_arrays(pd.DataFrame(dict(a=[[1], [2]])))
+
+
+def test_import_atlas_cache_roundtrip_filtered(cached_params):
+    cached_params.atlas_filter = AtlasFilter.bacteria
+    expected = atlas_import.import_atlas(cached_params)
+    actual = atlas_cache.load_atlas(cached_params)
+    assert_frame_equal(expected, actual)
+
+
+def test_load_atlas_cache_miss(cached_params):
+    assert atlas_cache.load_atlas(cached_params) is None
+
+
+def test_cache_key_depends_on_parameters(cached_params):
+    key = atlas_cache.cache_key(cached_params)
+    cached_params.adduct_list = ["m_plus_h"]
+    adduct_key = atlas_cache.cache_key(cached_params)
+    cached_params.atlas_filter = AtlasFilter.custom
+    cached_params.custom_filter = "Fungi"
+    custom_key = atlas_cache.cache_key(cached_params)
+    assert len({key, adduct_key, custom_key}) == 3
+
+
+def test_cache_key_depends_on_source_content(cached_params):
+    key = atlas_cache.cache_key(cached_params)
+    with open(cached_params.reference_db, "a") as f:
+        f.write("\n")
+    assert atlas_cache.cache_key(cached_params) != key
+
+
+def test_array_bundle_roundtrip(tmp_path):
+    arrays = dict(values=np.arange(5, dtype=np.int64), empty=np.empty(0))
+    assert atlas_cache.save_arrays(tmp_path / "bundle", arrays) == tmp_path / "bundle"
+    loaded = atlas_cache.load_arrays(tmp_path / "bundle", ["values", "empty"])
+    assert isinstance(loaded["values"], np.memmap)
+    assert loaded["values"].tolist() == [0, 1, 2, 3, 4]
+    assert len(loaded["empty"]) == 0
+
+
+def test_incomplete_array_bundle_not_loaded(tmp_path):
+    atlas_cache.write_npy(tmp_path / "values.npy", np.arange(5))
+    assert atlas_cache.load_arrays(tmp_path, ["values"]) is None
@@ -1,12 +1,13 @@
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import pytest
 from deepdiff import DeepDiff
 from pandas.testing import assert_series_equal
 
 from snapms.atlas_tools import atlas_import
-from snapms.config import Parameters
+from snapms.config import AtlasFilter, Parameters
 from snapms.exceptions import AdductNotFound
 
 # Test data has an intentional non-unicode name corruption in first compound
@@ -177,3 +178,86 @@ def test_import_atlas_columns():
     actual = atlas_import.import_atlas(params)
     print(actual.columns.values)
     assert not DeepDiff(expected, actual.columns.to_list(), ignore_order=True)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_iter_json_records(tmp_path, chunk_size):
+    fpath = tmp_path / "records.json"
+    fpath.write_text(' \n[{"a": 1, "b": "x]"},\n {"a": [2, {"c": null}]} , {} ]\n')
+    assert list(atlas_import.iter_json_records(fpath, chunk_size)) == [
+        {"a": 1, "b": "x]"},
+        {"a": [2, {"c": None}]},
+        {},
+    ]
+
+
+def test_iter_json_records_truncated(tmp_path):
+    fpath = tmp_path / "records.json"
+    fpath.write_text('[{"a": 1}, {"a": ')
+    with pytest.raises(ValueError):
+        list(atlas_import.iter_json_records(fpath, chunk_size=4))
+
+
+@pytest.mark.parametrize(
+    "atlas_filter,custom_filter",
+    [(AtlasFilter.full, None), (AtlasFilter.custom, "Ascomycota|Cyanobacteria")],
+)
+def test_import_atlas_streamed_matches_full(atlas_filter, custom_filter):
+    params = Parameters(
+        file_path=Path("."),
+        atlas_db_path=TEST_FILE_PATH,
+        output_path=Path("."),
+        atlas_filter=atlas_filter,
+        custom_filter=custom_filter,
+    )
+    expected = atlas_import.import_atlas(params)
+    params.stream_reference_db = True
+    actual = atlas_import.import_atlas(params)
+    assert not DeepDiff(
+        [
+            "npaid",
+            "exact_mass",
+            "smiles",
+            "m_plus_h",
+            "m_plus_na",
+            "origin_organism_type",
+            "origin_organism_taxon_name",
+            "origin_organism_taxon_ancestors",
+            "name",
+            "m_plus_nh4",
+            "m_plus_h_minus_h2o",
+            "m_plus_k",
+            "2m_plus_h",
+            "2m_plus_na",
+        ],
+        actual.columns.to_list(),
+        ignore_order=True,
+    )
+    assert actual.index.to_list() == expected.index.to_list()
+    for column in actual.columns.drop("origin_organism_taxon_ancestors"):
+        assert_series_equal(actual[column], expected[column])
+    assert [
+        [a["name"] for a in ancestors]
+        for ancestors in actual["origin_organism_taxon_ancestors"]
+    ] == [
+        [a["name"] for a in ancestors]
+        for ancestors in expected["origin_organism_taxon_ancestors"]
+    ]
+
+
+def test_import_atlas_compact_schema():
+    params = Parameters(
+        file_path=Path("."), atlas_db_path=TEST_FILE_PATH, output_path=Path(".")
+    )
+    df = atlas_import.import_atlas(params)
+    for column in ["origin_organism_type", "origin_organism_taxon_name"]:
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    for column in ["exact_mass", "m_plus_h", "m_plus_na", "2m_plus_na"]:
+        assert df[column].dtype == np.float64
+    assert df["smiles"].dtype == object
+
+
+def test_add_display_names():
+    df = pd.DataFrame({"name": ["Fakamycin", "Jadomycim³", "Unknown"]})
+    atlas_import.add_display_names(df)
+    assert df["display_name"].to_list() == ["Fakamycin", "Unknown", "Unknown"]
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+from snapms.atlas_tools import (
+    build_cache,
+    fingerprint_store,
+    neighbour_graph,
+    taxon_index,
+)
+from snapms.config import AtlasFilter
+
+
+def test_build_cache_selected_stores(cached_params):
+    build_cache.main([str(cached_params.reference_db), "--stores", "fingerprints"])
+    assert fingerprint_store.get_fingerprint_store(cached_params) is not None
+    assert neighbour_graph.get_neighbour_graph(cached_params) is None
+    cached_params.atlas_filter = AtlasFilter.bacteria
+    assert taxon_index.get_taxon_index(cached_params) is None
+
+
+def test_build_cache_all_stores(cached_params):
+    build_cache.main([str(cached_params.reference_db)])
+    assert fingerprint_store.get_fingerprint_store(cached_params) is not None
+    assert neighbour_graph.get_neighbour_graph(cached_params) is not None
+    cached_params.atlas_filter = AtlasFilter.bacteria
+    assert taxon_index.get_taxon_index(cached_params) is not None
+
+
+def test_package_import_does_not_load_build_cache():
+    code = "import sys, snapms; print('snapms.atlas_tools.build_cache' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from rdkit import DataStructs
+
+from snapms.atlas_tools import atlas_import, fingerprint_store
+from snapms.config import AtlasFilter
+from snapms.matching_tools import match_compounds
+from snapms.network_tools import create_networks
+
+
+def test_fingerprint_store_roundtrip(tmp_path):
+    smiles = ["CCO", "not a smiles", "c1ccccc1O"]
+    store = fingerprint_store.FingerprintStore.from_smiles(smiles)
+    store.save(tmp_path)
+    loaded = fingerprint_store.FingerprintStore.load(tmp_path)
+    assert isinstance(loaded.data, np.memmap)
+    assert len(loaded) == 3
+    assert loaded.fingerprint(1) is None
+    expected = create_networks.morgan_fingerprints(["CCO", "c1ccccc1O"])
+    for row_id, fp in zip([0, 2], expected):
+        assert DataStructs.DiceSimilarity(loaded.fingerprint(row_id), fp) == 1.0
+        assert loaded.fingerprint(row_id) == fp
+
+
+def test_import_atlas_does_not_build_fingerprint_store(cached_params):
+    atlas_import.import_atlas(cached_params)
+    assert fingerprint_store.get_fingerprint_store(cached_params) is None
+    fingerprint_store.build_fingerprint_store(
+        pd.read_json(cached_params.reference_db), cached_params
+    )
+    store = fingerprint_store.get_fingerprint_store(cached_params)
+    assert len(store) == 10
+
+
+def test_get_fingerprint_store_disabled_without_cache(cached_params):
+    fingerprint_store.build_fingerprint_store(
+        pd.read_json(cached_params.reference_db), cached_params
+    )
+    cached_params.use_cache = False
+    assert fingerprint_store.get_fingerprint_store(cached_params) is None
+
+
+def test_stored_similarity_matrix_matches_smiles(cached_params):
+    cached_params.atlas_filter = AtlasFilter.fungi
+    cached_params.ppm_error = 20000
+    atlas_df = atlas_import.import_atlas(cached_params)
+    store = fingerprint_store.build_fingerprint_store(
+        pd.read_json(cached_params.reference_db), cached_params
+    )
+    masses = atlas_df["m_plus_h"].to_list() + atlas_df["m_plus_na"].to_list()
+    matches = match_compounds.compute_adduct_matches(masses, cached_params, atlas_df)
+    expected = create_networks.similarity_matrix(matches.column("smiles").tolist())
+    actual = create_networks.stored_similarity_matrix(matches, store)
+    assert np.array_equal(actual, expected)
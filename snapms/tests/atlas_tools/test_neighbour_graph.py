@@ -0,0 +1,43 @@
+import networkx as nx
+import numpy as np
+
+from snapms.atlas_tools import atlas_import, neighbour_graph
+from snapms.config import AtlasFilter
+from snapms.matching_tools import match_compounds
+from snapms.network_tools import create_networks
+
+
+def test_neighbour_graph_roundtrip(cached_params):
+    atlas_import.import_atlas(cached_params)
+    assert neighbour_graph.get_neighbour_graph(cached_params) is None
+    graph = neighbour_graph.build_neighbour_graph(cached_params)
+    loaded = neighbour_graph.NeighbourGraph.load(
+        neighbour_graph.neighbour_graph_dir(cached_params)
+    )
+    assert len(loaded) == 10
+    assert loaded.cutoff == neighbour_graph.NEIGHBOUR_CUTOFF
+    assert (loaded.matrix != graph.matrix).nnz == 0
+    assert (loaded.matrix != loaded.matrix.T).nnz == 0
+    assert np.all(loaded.matrix.diagonal()[loaded.valid] == 1.0)
+
+
+def test_neighbour_graph_covers(cached_params):
+    atlas_import.import_atlas(cached_params)
+    graph = neighbour_graph.build_neighbour_graph(cached_params)
+    assert graph.covers(np.array([0, 3, 9]), 0.7)
+    assert not graph.covers(np.array([0, 3, 9]), 0.5)
+    assert not graph.covers(np.array([0, 10]), 0.7)
+
+
+def test_neighbour_graph_edges_match_similarity(cached_params):
+    cached_params.atlas_filter = AtlasFilter.fungi
+    cached_params.ppm_error = 20000
+    atlas_df = atlas_import.import_atlas(cached_params)
+    masses = atlas_df["m_plus_h"].to_list() + atlas_df["m_plus_na"].to_list()
+    matches = match_compounds.compute_adduct_matches(masses, cached_params, atlas_df)
+    expected = create_networks.match_compound_network(matches, cached_params)
+    neighbour_graph.build_neighbour_graph(cached_params)
+    actual = create_networks.match_compound_network(matches, cached_params)
+    assert actual.number_of_edges() > 0
+    assert list(actual.edges) == list(expected.edges)
+    assert nx.utils.graphs_equal(actual, expected)
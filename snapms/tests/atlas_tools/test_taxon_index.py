@@ -0,0 +1,89 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from snapms.atlas_tools import atlas_cache, atlas_import, taxon_index
+from snapms.config import AtlasFilter
+
+TEST_FILE_PATH = Path(__file__).parent / "test_atlas.json"
+
+
+@pytest.fixture
+def atlas_df() -> pd.DataFrame:
+    return atlas_import.normalize_dataframe(pd.read_json(TEST_FILE_PATH))
+
+
+def scan_filter(df: pd.DataFrame, names: str) -> pd.DataFrame:
+    """Row by row scan of the taxon names and ancestors of every compound"""
+    mask = [
+        any(
+            name == n or any(a["name"] == n for a in ancestors)
+            for n in map(str.strip, names.split("|"))
+        )
+        for name, ancestors in zip(
+            df["origin_organism_taxon_name"], df["origin_organism_taxon_ancestors"]
+        )
+    ]
+    return df[mask]
+
+
+def test_label_rows():
+    rows = taxon_index.LabelRows.from_label_lists([["b", "a"], [], ["a", "a"], ["c"]])
+    assert rows.labels.tolist() == ["a", "b", "c"]
+    assert rows.rows(["a"]).tolist() == [0, 2]
+    assert rows.rows(["c", "b", "missing"]).tolist() == [0, 3]
+    assert rows.rows(["missing"]).tolist() == []
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+@pytest.mark.parametrize(
+    "custom_value",
+    ["Fungi", "Ascomycota|Cyanobacteria", " Curvularia | Bacteria ", "Unknown taxon"],
+)
+def test_custom_filter_matches_scan(atlas_df, custom_value, indexed):
+    expected = scan_filter(atlas_df, custom_value)
+    index = taxon_index.taxon_rows(atlas_df) if indexed else None
+    actual = atlas_import.apply_db_filter(
+        atlas_df, AtlasFilter.custom, custom_value, index
+    )
+    assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+@pytest.mark.parametrize(
+    "filter_type,organism_type",
+    [(AtlasFilter.bacteria, "Bacterium"), (AtlasFilter.fungi, "Fungus")],
+)
+def test_organism_type_filter(atlas_df, filter_type, organism_type, indexed):
+    index = taxon_index.organism_type_rows(atlas_df) if indexed else None
+    actual = atlas_import.apply_db_filter(atlas_df, filter_type, taxon_index=index)
+    assert_frame_equal(
+        actual, atlas_df[atlas_df["origin_organism_type"] == organism_type]
+    )
+
+
+def test_import_atlas_uses_prebuilt_taxon_index(cached_params, atlas_df):
+    cached_params.atlas_filter = AtlasFilter.custom
+    cached_params.custom_filter = "Ascomycota|Bacteria"
+    # the import never builds the index
+    assert taxon_index.get_taxon_index(cached_params) is None
+    scanned = atlas_import.import_atlas(cached_params)
+    assert taxon_index.get_taxon_index(cached_params) is None
+    shutil.rmtree(atlas_cache.atlas_cache_path(cached_params))
+
+    taxon_index.build_taxon_index(atlas_df, cached_params)
+    loaded = taxon_index.get_taxon_index(cached_params)
+    assert isinstance(loaded.row_ids, np.memmap)
+    assert_frame_equal(atlas_import.import_atlas(cached_params), scanned)
+
+    cached_params.atlas_filter = AtlasFilter.fungi
+    assert taxon_index.get_taxon_index(cached_params).labels.tolist() == [
+        "Bacterium",
+        "Fungus",
+    ]
+    cached_params.atlas_filter = AtlasFilter.full
+    assert taxon_index.get_taxon_index(cached_params) is None
@@ -0,0 +1,21 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from snapms.config import Parameters
+
+TEST_ATLAS_PATH = Path(__file__).parent / "atlas_tools" / "test_atlas.json"
+
+
+@pytest.fixture
+def cached_params(tmp_path) -> Parameters:
+    """Parameters pointing to a copy of the test atlas so cache files land in tmp_path"""
+    atlas_path = tmp_path / "test_atlas.json"
+    shutil.copy(TEST_ATLAS_PATH, atlas_path)
+    return Parameters(
+        file_path=Path("."),
+        atlas_db_path=atlas_path,
+        output_path=tmp_path / "output",
+        use_cache=True,
+    )
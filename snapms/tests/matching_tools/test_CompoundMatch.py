@@ -1,4 +1,8 @@
-from snapms.matching_tools.CompoundMatch import CompoundMatch
+import numpy as np
+import pandas as pd
+import pytest
+
+from snapms.matching_tools.CompoundMatch import CompoundMatch, CompoundMatchTable
 
 TEST_DAT = dict(
     npaid="1",
@@ -13,6 +17,31 @@ TEST_DAT = dict(
 )
 
 
+@pytest.fixture
+def atlas_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        dict(
+            npaid=["NPA1", "NPA2", "NPA3"],
+            exact_mass=[100.0, 200.0, 300.0],
+            smiles=["C", "CC", "CCC"],
+            name=["Fakamycin", "Jadomycim\u00b3", "C"],
+            origin_organism_type=pd.Categorical(["Fungus", None, "Fungus"]),
+        )
+    )
+
+
+@pytest.fixture
+def match_table(atlas_df) -> CompoundMatchTable:
+    return CompoundMatchTable(
+        atlas_df=atlas_df,
+        rows=np.array([2, 0, 1, 2]),
+        masses=np.array([301.0, 101.0, 201.0, 301.1]),
+        compound_numbers=np.array([1, 1, 2, 2]),
+        adduct_codes=np.array([0, 0, 0, 1]),
+        adduct_list=["m_plus_h", "m_plus_na"],
+    )
+
+
 def test_CompoundMatch_has_attributes():
     comp = CompoundMatch(**TEST_DAT)
     assert comp.npaid == "1"
@@ -32,3 +61,45 @@ def test_CompoundMatch_cleans_bad_name():
     comp = CompoundMatch(**test_data)
     assert comp.npaid == "1"
     assert comp.friendly_name() == "Unknown"
+
+
+def test_CompoundMatchTable_creates_matches_on_demand(match_table):
+    assert len(match_table) == 4
+    assert match_table.column("smiles").tolist() == ["CCC", "C", "CC", "CCC"]
+    assert match_table.adducts.tolist() == [
+        "m_plus_h",
+        "m_plus_h",
+        "m_plus_h",
+        "m_plus_na",
+    ]
+    assert match_table[3] == CompoundMatch(
+        npaid="NPA3",
+        coconut_id=None,
+        exact_mass=300.0,
+        smiles="CCC",
+        name="C",
+        mass=301.1,
+        compound_number=2,
+        adduct="m_plus_na",
+        origin_organism_type="Fungus",
+    )
+    assert [c.npaid for c in match_table[1:3]] == ["NPA1", "NPA2"]
+
+
+def test_CompoundMatchTable_categorical_column(match_table):
+    column = match_table.column("origin_organism_type")
+    assert column.dtype == object
+    assert column[[0, 1, 3]].tolist() == ["Fungus", "Fungus", "Fungus"]
+    assert pd.isna(column[2])
+    assert match_table[0].origin_organism_type == "Fungus"
+
+
+def test_CompoundMatchTable_display_names(atlas_df, match_table):
+    assert match_table.display_names() == ["C", "Fakamycin", "Unknown", "C"]
+    atlas_df["display_name"] = ["precomputed 0", "precomputed 1", "precomputed 2"]
+    assert match_table.display_names() == [
+        "precomputed 2",
+        "precomputed 0",
+        "precomputed 1",
+        "precomputed 2",
+    ]
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from snapms.atlas_tools import atlas_cache, atlas_import
+from snapms.config import Parameters
+from snapms.matching_tools.adduct_index import AdductIndex
+
+TEST_FILE_PATH = Path(__file__).parents[1] / "atlas_tools" / "test_atlas.json"
+
+
+@pytest.fixture(scope="module")
+def atlas_df():
+    params = Parameters(
+        file_path=Path("."), atlas_db_path=TEST_FILE_PATH, output_path=Path(".")
+    )
+    return atlas_import.import_atlas(params)
+
+
+def from_atlas(atlas_df, adduct_list):
+    return AdductIndex.from_matrix(
+        atlas_import.atlas_adduct_matrix(atlas_df, adduct_list), adduct_list
+    )
+
+
+def test_adduct_index_is_sorted(atlas_df):
+    index = from_atlas(atlas_df, ["m_plus_h", "2m_plus_na"])
+    for adduct in index.adducts:
+        assert np.all(np.diff(index.masses[adduct]) >= 0)
+        assert np.array_equal(
+            index.masses[adduct], atlas_df[adduct].to_numpy()[index.rows[adduct]]
+        )
+
+
+def test_adduct_index_save_load_mmap(atlas_df, tmp_path):
+    adducts = ["m_plus_h", "m_plus_k"]
+    index = from_atlas(atlas_df, adducts)
+    assert index.save(tmp_path) == tmp_path
+    loaded = AdductIndex.load(tmp_path, adducts)
+    for adduct in adducts:
+        assert isinstance(loaded.masses[adduct], np.memmap)
+        assert np.array_equal(loaded.masses[adduct], index.masses[adduct])
+        assert np.array_equal(loaded.rows[adduct], index.rows[adduct])
+
+
+def test_adduct_index_load_missing_adduct(atlas_df, tmp_path):
+    from_atlas(atlas_df, ["m_plus_h"]).save(tmp_path)
+    assert AdductIndex.load(tmp_path, ["m_plus_h", "m_plus_k"]) is None
+    assert AdductIndex.load(tmp_path, ["m_plus_h"]) is not None
+
+
+def test_adduct_index_load_incomplete_bundle(atlas_df, tmp_path):
+    from_atlas(atlas_df, ["m_plus_h"]).save(tmp_path)
+    (tmp_path / atlas_cache.COMPLETE_MARKER).unlink()
+    assert AdductIndex.load(tmp_path, ["m_plus_h"]) is None
+
+
+def test_adduct_index_from_matrix():
+    matrix = np.array([[3.0, 1.0], [1.0, 1.0], [2.0, 0.5]])
+    index = AdductIndex.from_matrix(matrix, ["a", "b"])
+    assert index.adducts == ["a", "b"]
+    assert index.masses["a"].tolist() == [1.0, 2.0, 3.0]
+    assert index.rows["a"].tolist() == [1, 2, 0]
+    assert index.masses["b"].tolist() == [0.5, 1.0, 1.0]
+    assert index.rows["b"].tolist() == [2, 0, 1]
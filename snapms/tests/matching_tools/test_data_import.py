@@ -0,0 +1,132 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from snapms.matching_tools import data_import
+
+GNPS_GRAPHML = """<?xml version='1.0' encoding='utf-8'?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="d0" for="node" attr.name="parent mass" attr.type="double" />
+  <key id="d1" for="node" attr.name="componentindex" attr.type="long">
+    <default>-1</default>
+  </key>
+  <key id="d2" for="node" attr.name="cluster index" attr.type="long" />
+  <key id="e0" for="edge" attr.name="cosine_score" attr.type="double" />
+  <graph edgedefault="directed">
+    <node id="10"><data key="d0">420.1421</data><data key="d1">4</data><data key="d2">10</data></node>
+    <edge source="10" target="12"><data key="e0">0.8</data></edge>
+    <node id="12"><data key="d0">438.1752</data><data key="d1">4</data><data key="d2">12</data></node>
+    <node id="7"><data key="d0">301.5</data><data key="d2">7</data></node>
+    <node id="3"><data key="d0">454.1481</data><data key="d1">4</data><data key="d2">3</data></node>
+    <edge source="3" target="12"><data key="e0">0.7</data></edge>
+  </graph>
+</graphml>
+"""
+
+
+@pytest.fixture
+def gnps_graphml(tmp_path):
+    fpath = tmp_path / "gnps.graphml"
+    fpath.write_text(GNPS_GRAPHML)
+    return fpath
+
+
+def test_read_gnps_graphml(gnps_graphml):
+    network = data_import.read_gnps_graphml(gnps_graphml)
+    assert len(network) == 4
+    assert network.node_ids.tolist() == ["10", "12", "7", "3"]
+    assert network.parent_masses.dtype == np.float64
+    assert network.parent_masses.tolist() == [420.1421, 438.1752, 301.5, 454.1481]
+    assert network.component_ids.tolist() == [4, 4, -1, 4]
+    assert network.edges.tolist() == [[0, 1], [3, 1]]
+    assert network.adjacency().toarray().tolist() == [
+        [0, 1, 0, 0],
+        [1, 0, 0, 1],
+        [0, 0, 0, 0],
+        [0, 1, 0, 0],
+    ]
+
+
+def test_read_gnps_graphml_matches_networkx(tmp_path):
+    G = nx.Graph()
+    for node in range(6):
+        G.add_node(
+            node, **{"parent mass": 300.0 + node / 3, "componentindex": node // 3}
+        )
+    G.add_edges_from([(0, 1), (1, 2), (3, 5), (4, 5)])
+    nx.write_graphml(G, tmp_path / "gnps.graphml")
+    network = data_import.read_gnps_graphml(tmp_path / "gnps.graphml")
+    assert network.node_ids.tolist() == [str(node) for node in G.nodes]
+    assert network.parent_masses.tolist() == [
+        mass for _, mass in G.nodes(data="parent mass")
+    ]
+    assert network.component_ids.tolist() == [
+        c for _, c in G.nodes(data="componentindex")
+    ]
+    assert network.edges.tolist() == [list(edge) for edge in G.edges]
+
+
+def test_read_gnps_graphml_missing_mass(tmp_path):
+    fpath = tmp_path / "gnps.graphml"
+    fpath.write_text(GNPS_GRAPHML.replace('<data key="d0">301.5</data>', ""))
+    with pytest.raises(ValueError, match="GNPS node 7"):
+        data_import.read_gnps_graphml(fpath)
+
+
+def test_clusters_by_componentindex(gnps_graphml):
+    network = data_import.read_gnps_graphml(gnps_graphml)
+    cluster_ids, cluster_nodes = network.clusters()
+    assert cluster_ids == [4, -1]
+    assert [nodes.tolist() for nodes in cluster_nodes] == [[0, 1, 3], [2]]
+
+
+def test_clusters_keep_singletons_apart():
+    network = data_import.GNPSNetwork(
+        np.array(["a", "b", "c", "d", "e"], dtype=object),
+        np.arange(5, dtype=np.float64),
+        np.array([-1, 2, -1, 1, 2]),
+        np.array([[1, 4]]),
+    )
+    cluster_ids, cluster_nodes = network.clusters()
+    assert cluster_ids == [-1, 2, -1, 1]
+    assert [nodes.tolist() for nodes in cluster_nodes] == [[0], [1, 4], [2], [3]]
+
+
+def test_clusters_without_componentindex(gnps_graphml, tmp_path):
+    fpath = tmp_path / "no_components.graphml"
+    fpath.write_text(
+        GNPS_GRAPHML.replace('<data key="d1">4</data>', "").replace(
+            "<default>-1</default>", ""
+        )
+    )
+    network = data_import.read_gnps_graphml(fpath)
+    assert network.component_ids is None
+    cluster_ids, cluster_nodes = network.clusters()
+    assert cluster_ids == [1, 2]
+    assert [nodes.tolist() for nodes in cluster_nodes] == [[0, 1, 3], [2]]
+
+
+def test_read_gnps_node_table(tmp_path):
+    fpath = tmp_path / "clusterinfo_summary.tsv"
+    fpath.write_text(
+        "cluster index\tparent mass\tprecursor charge\tcomponentindex\n"
+        "10\t420.1421\t1\t4\n"
+        "12\t438.1752\t1\t4\n"
+        "7\t301.5\t1\t-1\n"
+        "3\t454.1481\t1\t4\n"
+    )
+    network = data_import.read_gnps_node_table(fpath)
+    assert network.node_ids.tolist() == ["10", "12", "7", "3"]
+    assert network.parent_masses.tolist() == [420.1421, 438.1752, 301.5, 454.1481]
+    assert network.component_ids.tolist() == [4, 4, -1, 4]
+    assert network.edges.shape == (0, 2)
+    cluster_ids, cluster_nodes = network.clusters()
+    assert cluster_ids == [4, -1]
+    assert [nodes.tolist() for nodes in cluster_nodes] == [[0, 1, 3], [2]]
+
+
+def test_read_gnps_node_table_missing_column(tmp_path):
+    fpath = tmp_path / "nodes.tsv"
+    fpath.write_text("parent mass\tcluster index\n420.1421\t1\n")
+    with pytest.raises(ValueError, match="componentindex"):
+        data_import.read_gnps_node_table(fpath)
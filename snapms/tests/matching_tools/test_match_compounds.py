@@ -1,8 +1,27 @@
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+import pandas as pd
 import pytest
 
+from snapms.atlas_tools import atlas_import
+from snapms.config import Parameters
 from snapms.matching_tools import match_compounds as mc
+from snapms.matching_tools.adduct_index import AdductIndex
 from snapms.matching_tools.CompoundMatch import CompoundMatch
 
+ATLAS_PATH = Path(__file__).parents[1] / "atlas_tools" / "test_atlas.json"
+
+
+@pytest.fixture(scope="module")
+def atlas_df() -> pd.DataFrame:
+    """Test atlas imported once for the module, the processed dataframe does not depend on the ppm error"""
+    params = Parameters(
+        file_path=Path("."), atlas_db_path=ATLAS_PATH, output_path=Path(".")
+    )
+    return atlas_import.import_atlas(params)
+
 
 def test_calculate_error_default():
     mass = 18.0
@@ -66,3 +85,197 @@ def test_compound_match():
     # test computed prop
     assert compound.npatlas_url == "https://www.npatlas.org/explore/compounds/NPA018705"
     assert compound.friendly_name() == "Unknown"
+
+
+def test_compute_adduct_matches_finds_own_adduct(atlas_df):
+    params = Parameters(
+        file_path=Path("."), atlas_db_path=ATLAS_PATH, output_path=Path(".")
+    )
+    masses = [atlas_df["m_plus_h"].iloc[2], atlas_df["m_plus_na"].iloc[5]]
+    matches = mc.compute_adduct_matches(masses, params, atlas_df)
+    assert (atlas_df["npaid"].iloc[2], 1, "m_plus_h") in [
+        (c.npaid, c.compound_number, c.adduct) for c in matches
+    ]
+    assert (atlas_df["npaid"].iloc[5], 2, "m_plus_na") in [
+        (c.npaid, c.compound_number, c.adduct) for c in matches
+    ]
+    assert all(c.coconut_id is None for c in matches)
+
+
+def test_calculate_errors_matches_scalar():
+    masses = np.array([18.0, 423.123, 25.0, 1234.56789])
+    expected = [mc.calculate_error(m, 10.0) for m in masses.tolist()]
+    assert mc.calculate_errors(masses, 10.0).tolist() == expected
+
+
+def test_match_mass_array_matches_column_scan():
+    atlas_df = pd.DataFrame(
+        {
+            "m_plus_h": [300.1, 200.0, 300.1005, 500.0, 200.0001],
+            "m_plus_na": [322.1, 222.0, 200.0, 522.0, 222.0001],
+        }
+    )
+    adducts = ["m_plus_h", "m_plus_na"]
+    index = AdductIndex.from_matrix(atlas_df[adducts].to_numpy(), adducts)
+    masses = np.array([200.0, 300.1, 900.0])
+    expected = []
+    for mass_pos, mass in enumerate(masses.tolist()):
+        error = mc.calculate_error(mass, 10)
+        for adduct_pos, adduct in enumerate(adducts):
+            mask = atlas_df[adduct].between(mass - error, mass + error).to_numpy()
+            expected += [(mass_pos, adduct_pos, r) for r in np.flatnonzero(mask)]
+    actual = list(
+        zip(*(a.tolist() for a in mc.match_mass_array(masses, 10, index, adducts)))
+    )
+    assert actual == expected
+
+
+def test_compute_cluster_adduct_matches_matches_individual_calls(atlas_df):
+    params = Parameters(
+        file_path=Path("."),
+        atlas_db_path=ATLAS_PATH,
+        output_path=Path("."),
+        ppm_error=5000,
+    )
+    mass_lists = [
+        atlas_df["m_plus_h"].to_list()[:4],
+        [],
+        [1.0],
+        atlas_df["m_plus_k"].to_list()[3:],
+    ]
+    expected = [
+        list(mc.compute_adduct_matches(m, params, atlas_df)) for m in mass_lists
+    ]
+    actual = [
+        list(t) for t in mc.compute_cluster_adduct_matches(mass_lists, params, atlas_df)
+    ]
+    assert actual == expected
+    assert actual[1] == [] and actual[2] == []
+    assert actual[3][0].compound_number == 1
+
+
+def test_remove_duplicates_only_kept_masses_remove():
+    """A mass close to a removed mass, but not to a kept one, is kept"""
+    mass_list = [100.0, 100.0009, 100.0018, 100.0]
+    assert mc.remove_mass_duplicates(mass_list, 10.0) == [100.0, 100.0018]
+
+
+def test_unique_mass_positions():
+    masses = np.array([420.1421, 422.1585, 438.1752, 440.133, 420.1422])
+    positions = mc.unique_mass_positions(masses, 10.0)
+    assert positions.tolist() == [0, 1, 2, 3]
+    assert mc.unique_mass_positions(np.array([]), 10.0).tolist() == []
+
+
+def test_build_cluster_networks_parallel_matches_serial(atlas_df):
+    params = Parameters(
+        file_path=Path("."),
+        atlas_db_path=ATLAS_PATH,
+        output_path=Path("."),
+        ppm_error=20000,
+    )
+    cluster_ids = [7, 2, 5]
+    mass_lists = [
+        atlas_df["m_plus_h"].to_list()[:5],
+        atlas_df["m_plus_na"].to_list(),
+        atlas_df["m_plus_h"].to_list()[5:],
+    ]
+    tables = mc.compute_cluster_adduct_matches(mass_lists, params, atlas_df)
+    serial = mc.build_cluster_networks(cluster_ids, tables, atlas_df, params)
+    params.workers = 2
+    parallel = mc.build_cluster_networks(cluster_ids, tables, atlas_df, params)
+    assert list(serial) == list(parallel) == [2, 5, 7]
+    for cluster_id, graph in serial.items():
+        G = graph.to_networkx()
+        H = parallel[cluster_id].to_networkx()
+        assert list(G.nodes(data=True)) == list(H.nodes(data=True))
+        assert list(G.edges) == list(H.edges)
+        assert set(nx.get_node_attributes(G, "componentindex").values()) == {cluster_id}
+
+
+def test_sweep_gnps_network_matches_separate_runs(tmp_path, atlas_df):
+    params = Parameters(
+        file_path=tmp_path / "gnps.graphml",
+        atlas_db_path=ATLAS_PATH,
+        output_path=tmp_path,
+        ppm_error=2000,
+        min_gnps_size=2,
+    )
+    # clusters of parent masses near (and off by up to ~3000 ppm from) Atlas adduct masses
+    gnps_graph = nx.Graph()
+    cluster_masses = [
+        atlas_df["m_plus_h"].to_list(),
+        [m * 1.0025 for m in atlas_df["m_plus_na"].to_list()],
+        [m * 0.9992 for m in atlas_df["m_plus_h"].to_list()[:4]] + [500.0, 500.5],
+    ]
+    for cluster_id, masses in enumerate(cluster_masses, start=1):
+        for pos, mass in enumerate(masses):
+            gnps_graph.add_node(
+                f"{cluster_id}_{pos}",
+                **{"parent mass": mass, "componentindex": cluster_id},
+            )
+            if pos:
+                gnps_graph.add_edge(f"{cluster_id}_{pos - 1}", f"{cluster_id}_{pos}")
+    nx.write_graphml(gnps_graph, params.file_path)
+
+    params.sweep_ppm_errors = [1000, 3000]
+    params.sweep_cutoffs = [0.15, 0.3, 0.66]
+    sweep = mc.sweep_gnps_network(atlas_df, params)
+    assert list(sweep) == [(p, c) for p in [1000, 3000] for c in [0.15, 0.3, 0.66]]
+    for (ppm_error, cutoff), networks in sweep.items():
+        params.ppm_error = ppm_error
+        params.similarity_cutoff = cutoff
+        expected = mc.annotate_gnps_network(atlas_df, params)
+        assert list(networks) == list(expected)
+        for cluster_id, graph in expected.items():
+            G = graph.to_networkx()
+            H = networks[cluster_id].to_networkx()
+            assert list(G.nodes(data=True)) == list(H.nodes(data=True))
+            assert sorted(G.edges) == sorted(H.edges)
+    assert sum(G.number_of_edges() for G in sweep[(3000, 0.15)].values()) > sum(
+        G.number_of_edges() for G in sweep[(3000, 0.66)].values()
+    )
+
+
+def test_gnps_cluster_mass_lists_in_file_order(tmp_path):
+    gnps_graph = nx.Graph()
+    for node, mass, component in [
+        (5, 301.1, 8),
+        (2, 402.2, 3),
+        (9, 503.3, 3),
+        (1, 604.4, 3),
+        (7, 705.5, 8),
+    ]:
+        gnps_graph.add_node(node, **{"parent mass": mass, "componentindex": component})
+    gnps_graph.add_edges_from([(9, 1), (5, 7), (1, 2)])
+    nx.write_graphml(gnps_graph, tmp_path / "gnps.graphml")
+    params = Parameters(tmp_path / "gnps.graphml", Path("."), tmp_path, min_gnps_size=2)
+    assert mc.gnps_cluster_mass_lists(params) == (
+        [8, 3],
+        [[301.1, 705.5], [402.2, 503.3, 604.4]],
+    )
+    params.min_gnps_cluster_size = 3
+    assert mc.gnps_cluster_mass_lists(params) == ([3], [[402.2, 503.3, 604.4]])
+
+
+def test_annotate_gnps_node_table_matches_graphml(tmp_path, atlas_df):
+    params = Parameters(tmp_path / "gnps.graphml", ATLAS_PATH, tmp_path, ppm_error=2000)
+    gnps_graph = nx.Graph()
+    rows = ["cluster index\tparent mass\tcomponentindex"]
+    for pos, mass in enumerate(atlas_df["m_plus_h"].to_list()):
+        gnps_graph.add_node(pos, **{"parent mass": mass, "componentindex": 1})
+        rows.append(f"{pos}\t{mass!r}\t1")
+        if pos:
+            gnps_graph.add_edge(pos - 1, pos)
+    nx.write_graphml(gnps_graph, params.file_path)
+    table_path = tmp_path / "clusterinfo_summary.tsv"
+    table_path.write_text("\n".join(rows) + "\n")
+
+    expected = mc.annotate_gnps_network(atlas_df, params)
+    table_params = Parameters(table_path, ATLAS_PATH, tmp_path, ppm_error=2000)
+    networks = mc.annotate_gnps_network(atlas_df, table_params)
+    assert list(networks) == list(expected) == [1]
+    G = expected[1].to_networkx()
+    H = networks[1].to_networkx()
+    assert list(G.nodes(data=True)) == list(H.nodes(data=True))
+    assert list(G.edges) == list(H.edges)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from rdkit import Chem, DataStructs
+from rdkit.Chem import AllChem
+
+from snapms.network_tools import bit_similarity, create_networks
+
+SMILES = [
+    "C",
+    "CC",
+    "CCC",
+    "CCO",
+    "c1ccccc1O",
+    "c1ccccc1N",
+    "CC(=O)Oc1ccccc1C(=O)O",
+    "CC",
+]
+
+
+def rdkit_bit_dice(smiles):
+    fps = [
+        AllChem.GetMorganFingerprintAsBitVect(
+            Chem.MolFromSmiles(s), 2, nBits=bit_similarity.BIT_LENGTH
+        )
+        for s in smiles
+    ]
+    return np.array([DataStructs.BulkDiceSimilarity(fp, fps) for fp in fps])
+
+
+def test_packed_fingerprints_shape():
+    packed = bit_similarity.packed_fingerprints(SMILES)
+    assert packed.dtype == np.uint64
+    assert packed.shape == (len(SMILES), bit_similarity.BIT_LENGTH // 64)
+
+
+def test_popcount():
+    words = np.array([[0, 1, 2**64 - 1], [3, 2**63, 0]], dtype=np.uint64)
+    assert bit_similarity.popcount(words).tolist() == [65, 3]
+
+
+def test_dice_matrix_matches_rdkit_bit_vectors():
+    matrix = bit_similarity.dice_matrix(bit_similarity.packed_fingerprints(SMILES))
+    assert matrix.dtype == np.float32
+    assert np.allclose(matrix, rdkit_bit_dice(SMILES), atol=1e-6)
+
+
+@pytest.mark.parametrize("cutoff", [None, 0.4])
+def test_dice_matrix_blocks(monkeypatch, cutoff):
+    packed = bit_similarity.packed_fingerprints(SMILES)
+    expected = bit_similarity.dice_matrix(packed, cutoff)
+    monkeypatch.setattr(bit_similarity, "BLOCK_BYTES", 1)
+    matrix = bit_similarity.dice_matrix(packed, cutoff)
+    if cutoff is not None:
+        # scores below the cutoff may or may not be pruned, depending on the block bounds
+        matrix[matrix < cutoff] = 0
+        expected[expected < cutoff] = 0
+    assert np.array_equal(matrix, expected)
+
+
+def test_unpacked_bits():
+    packed = bit_similarity.packed_fingerprints(SMILES)
+    bits = bit_similarity.unpacked_bits(packed)
+    assert bits.shape == (len(SMILES), bit_similarity.BIT_LENGTH)
+    assert bits.sum(axis=1).tolist() == bit_similarity.popcount(packed).tolist()
+
+
+def test_packed_similarity_matrix_duplicate_smiles():
+    matrix = create_networks.packed_similarity_matrix(SMILES)
+    assert matrix[1, 7] == 1.0
+    assert np.array_equal(matrix[1], matrix[7])
@@ -0,0 +1,109 @@
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from snapms.config import Parameters
+from snapms.network_tools import create_networks
+from snapms.network_tools.compound_graph import CompoundGraph
+
+CWD = Path(__file__).parent
+
+
+@pytest.fixture
+def test_graph() -> nx.Graph:
+    return nx.read_graphml(CWD / "test_snapms.graphml")
+
+
+def assert_same_graph(G: nx.Graph, H: nx.Graph):
+    assert list(G.nodes(data=True)) == list(H.nodes(data=True))
+    assert sorted(map(sorted, G.edges)) == sorted(map(sorted, H.edges))
+
+
+def test_from_edges():
+    graph = CompoundGraph.from_edges(
+        4, np.array([[0, 1], [1, 2]]), {"compound_group": [1, 2, 2, 3]}
+    )
+    assert len(graph) == 4
+    assert graph.number_of_edges() == 2
+    assert graph.edges().tolist() == [[0, 1], [1, 2]]
+    assert graph.compound_group_counts() == {0: 2, 1: 1}
+
+
+def test_networkx_roundtrip(test_graph):
+    graph = CompoundGraph.from_networkx(test_graph)
+    assert len(graph) == len(test_graph)
+    assert graph.number_of_edges() == test_graph.number_of_edges()
+    assert_same_graph(graph.to_networkx(), test_graph)
+
+
+def test_compound_group_counts_match_networkx(test_graph):
+    graph = CompoundGraph.from_networkx(test_graph)
+    assert create_networks.get_compound_group_count(
+        graph
+    ) == create_networks.get_compound_group_count(test_graph)
+
+
+@pytest.mark.parametrize("min_group_count,min_cluster_size", [(3, 3), (6, 3), (3, 70)])
+def test_size_check_matches_networkx(test_graph, min_group_count, min_cluster_size):
+    graph = CompoundGraph.from_networkx(test_graph)
+    assert graph.size_check(
+        min_group_count, min_cluster_size
+    ) == create_networks.graph_size_check(test_graph, min_group_count, min_cluster_size)
+
+
+@pytest.mark.parametrize("min_size", [1, 3, 5, 10])
+def test_post_processing_matches_networkx(test_graph, min_size, tmp_path):
+    graph = CompoundGraph.from_networkx(test_graph)
+    params = Parameters(Path("."), Path("."), tmp_path, min_atlas_size=min_size)
+    for G in (graph, test_graph):
+        create_networks.remove_small_subgraphs(G, params)
+        create_networks.annotate_top_candidates(G)
+    assert_same_graph(graph.to_networkx(), test_graph)
+
+
+def test_set_node_attribute_and_with_edges():
+    graph = CompoundGraph.from_edges(
+        3, np.array([[0, 1]]), {"compound_group": [1, 2, 3]}
+    )
+    graph.set_node_attribute("componentindex", 7)
+    other = graph.with_edges(np.array([[0, 2], [1, 2]]))
+    assert graph.edges().tolist() == [[0, 1]]
+    assert other.edges().tolist() == [[0, 2], [1, 2]]
+    assert other.to_networkx().nodes[2] == {"compound_group": 3, "componentindex": 7}
+
+
+def test_component_summary_matches_networkx(test_graph):
+    summary = CompoundGraph.from_networkx(test_graph).summary
+    components = list(nx.connected_components(test_graph))
+    assert summary.n_components == len(components)
+    assert summary.sizes.tolist() == [len(c) for c in components]
+    assert summary.edge_counts.tolist() == [
+        test_graph.subgraph(c).number_of_edges() for c in components
+    ]
+    assert summary.group_counts.tolist() == [
+        len({test_graph.nodes[n]["compound_group"] for n in c}) for c in components
+    ]
+
+
+def test_component_summary_reused_until_nodes_removed():
+    graph = CompoundGraph.from_edges(
+        6,
+        np.array([[0, 3], [1, 2], [3, 4]]),
+        {"compound_group": [1, 1, 2, 2, 3, 4]},
+    )
+    summary = graph.summary
+    assert summary.labels.tolist() == [0, 1, 1, 0, 0, 2]
+    assert summary.group_counts.tolist() == [3, 2, 1]
+    assert graph.size_check(1, 1)
+    graph.annotate_top_candidates()
+    assert graph.summary is summary
+    graph.remove_nodes(np.ones(6, dtype=bool))
+    assert graph.summary is summary
+    graph.remove_small_subgraphs(2)
+    assert graph.summary.labels.tolist() == [0, 1, 1, 0, 0]
+    assert graph.summary.sizes.tolist() == [3, 2]
+    graph.remove_nodes(np.array([True, True, True, True, False]))
+    assert graph.summary is not summary
+    assert graph.summary.edge_counts.tolist() == [1, 1]
@@ -1,6 +1,7 @@
 from pathlib import Path
 
 import networkx as nx
+import numpy as np
 import pytest
 
 from snapms.network_tools import create_networks
@@ -39,6 +40,42 @@ def test_tanimoto_matrix():
                 assert matrix[ri] == pytest.approx(expected[ci])
 
 
+def test_similarity_matrix_matches_tanimoto_matrix():
+    smiles = ["C", "CC", "CCC", "CCO"]
+    matrix = create_networks.similarity_matrix(smiles)
+    assert isinstance(matrix, np.ndarray)
+    assert matrix.tolist() == create_networks.tanimoto_matrix(smiles)
+
+
+def test_similarity_matrix_duplicate_smiles():
+    """Repeated SMILES are fingerprinted once and expanded back to every position"""
+    smiles = ["CC", "C", "CCC", "CC", "C"]
+    unique = create_networks.similarity_matrix(["CC", "C", "CCC"])
+    expected = unique[np.ix_([0, 1, 2, 0, 1], [0, 1, 2, 0, 1])]
+    assert np.array_equal(create_networks.similarity_matrix(smiles), expected)
+
+
+def test_unique_inverse():
+    uniques, inverse = create_networks.unique_inverse(["b", "a", "b", "c"])
+    assert uniques == ["b", "a", "c"]
+    assert inverse.tolist() == [0, 1, 0, 2]
+
+
+def test_similarity_edges():
+    """Edges are above cutoff, upper triangle only and never inside a compound group"""
+    matrix = np.array(
+        [
+            [1.0, 0.7, 0.9, 0.1],
+            [0.7, 1.0, 0.66, 0.8],
+            [0.9, 0.66, 1.0, 0.2],
+            [0.1, 0.8, 0.2, 1.0],
+        ]
+    )
+    groups = np.array([1, 2, 1, 3])
+    edges = create_networks.similarity_edges(matrix, groups, 0.66)
+    assert edges.tolist() == [[0, 1], [1, 2], [1, 3]]
+
+
 def test_compound_group_counter_all_the_same():
     """Tests counting of compound groups when all values the same"""
     nodes = [
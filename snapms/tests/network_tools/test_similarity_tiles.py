@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from snapms.atlas_tools import atlas_import
+from snapms.config import Parameters, SimilarityEngine
+from snapms.matching_tools import match_compounds
+from snapms.network_tools import bit_similarity, create_networks, similarity_tiles
+
+TEST_FILE_PATH = Path(__file__).parents[1] / "atlas_tools" / "test_atlas.json"
+SMILES = ["C", "CC", "CCC", "CCO", "c1ccccc1O", "c1ccccc1N", "CCCO"]
+
+
+def test_tile_bounds():
+    assert similarity_tiles.tile_bounds(5, 10, 20) == [(0, 2), (2, 4), (4, 5)]
+    assert similarity_tiles.tile_bounds(5, 10, 20, threads=2) == [
+        (0, 1),
+        (1, 2),
+        (2, 3),
+        (3, 4),
+        (4, 5),
+    ]
+    # always at least one row per tile
+    assert similarity_tiles.tile_bounds(2, 100, 1) == [(0, 1), (1, 2)]
+    assert similarity_tiles.tile_bounds(0, 10, 20) == []
+
+
+@pytest.mark.parametrize("memory_budget,threads", [(1, 1), (1, 4), (10**9, 1)])
+def test_blockwise_pairs_match_dense(memory_budget, threads):
+    fingerprints = create_networks.morgan_fingerprints(SMILES)
+    rows, cols, scores = similarity_tiles.blockwise_pairs(
+        len(SMILES),
+        similarity_tiles.rdkit_dice_tiles(fingerprints, 0.3),
+        bytes_per_row=8 * len(SMILES),
+        memory_budget=memory_budget,
+        threads=threads,
+    )
+    matrix = create_networks.dice_matrix(fingerprints)
+    expected = np.argwhere(np.triu(matrix >= 0.3))
+    assert np.array_equal(np.column_stack((rows, cols)), expected)
+    assert np.array_equal(scores, matrix[rows, cols])
+
+
+def test_expand_adjacency():
+    pairs = (np.array([0, 0, 1]), np.array([0, 1, 1]), np.ones(3))
+    adjacency = similarity_tiles.pairs_adjacency(pairs, 3)
+    expanded = similarity_tiles.expand_adjacency(adjacency, np.array([1, 0, 1, 2]))
+    assert expanded.toarray().tolist() == [
+        [1, 1, 1, 0],
+        [1, 1, 1, 0],
+        [1, 1, 1, 0],
+        [0, 0, 0, 0],
+    ]
+
+
+@pytest.mark.parametrize("engine", list(SimilarityEngine))
+def test_compound_similarity_edges_blockwise(tmp_path, engine):
+    """Scoring in tiles gives exactly the edges of the dense matrix"""
+    params = Parameters(
+        Path("."),
+        TEST_FILE_PATH,
+        tmp_path,
+        ppm_error=20000,
+        similarity_engine=engine,
+    )
+    atlas_df = atlas_import.import_atlas(params)
+    masses = atlas_df["m_plus_h"].to_list() + atlas_df["m_plus_na"].to_list()
+    matches = match_compounds.compute_adduct_matches(masses, params, atlas_df)
+    expected = create_networks.compound_similarity_edges(matches, params, 0.66)
+    params.similarity_memory = 1
+    params.similarity_threads = 3
+    actual = create_networks.compound_similarity_edges(matches, params, 0.66)
+    assert len(expected) > 0
+    assert np.array_equal(actual, expected)
+
+
+def test_popcount_bounds():
+    counts = np.array([10, 4, 6, 20, 5])
+    order, stops = similarity_tiles.popcount_bounds(counts, 0.5)
+    assert order.tolist() == [1, 4, 2, 0, 3]
+    # partners of a need b <= 3a at a cutoff of 0.5
+    assert stops.tolist() == [4, 4, 4, 5, 5]
+    _, no_pruning = similarity_tiles.popcount_bounds(counts, 0)
+    assert no_pruning.tolist() == [5] * 5
+
+
+@pytest.mark.parametrize("cutoff", [0.2, 0.5, 0.66, 0.9])
+def test_popcount_pruning_keeps_all_pairs(cutoff):
+    smiles = pd.read_json(TEST_FILE_PATH)["smiles"].to_list() + SMILES
+    fingerprints = create_networks.morgan_fingerprints(smiles)
+    full = create_networks.dice_matrix(fingerprints)
+    rows, cols, scores = similarity_tiles.pruned_rdkit_pairs(
+        fingerprints, cutoff, memory_budget=1
+    )
+    expected = np.argwhere(np.triu(full >= cutoff))
+    assert np.array_equal(np.column_stack((rows, cols)), expected)
+    assert np.array_equal(scores, full[rows, cols])
+    pruned = create_networks.dice_matrix(fingerprints, cutoff)
+    assert np.array_equal(pruned >= cutoff, full >= cutoff)
+    assert np.array_equal(pruned[full >= cutoff], full[full >= cutoff])
+
+
+@pytest.mark.parametrize("cutoff", [0.2, 0.5, 0.66, 0.9])
+def test_popcount_pruning_bitpacked(cutoff):
+    smiles = pd.read_json(TEST_FILE_PATH)["smiles"].to_list() + SMILES
+    packed = bit_similarity.packed_fingerprints(smiles)
+    full = bit_similarity.dice_matrix(packed)
+    rows, cols, scores = bit_similarity.dice_pairs(packed, cutoff, memory_budget=1)
+    expected = np.argwhere(np.triu(full >= cutoff))
+    assert np.array_equal(np.column_stack((rows, cols)), expected)
+    assert np.array_equal(scores, full[rows, cols])
+    pruned = bit_similarity.dice_matrix(packed, cutoff)
+    assert np.array_equal(pruned >= cutoff, full >= cutoff)
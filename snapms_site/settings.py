@@ -167,3 +167,5 @@ try:
 except (TypeError, AssertionError):
     warnings.warn("COCONUT_FILE not available")
     COCONUT_FILE = None
+# Number of processes each job may use to build GNPS cluster networks
+SNAPMS_WORKERS = int(os.getenv("SNAPMS_WORKERS", "1"))
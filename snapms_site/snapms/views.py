@@ -15,7 +15,7 @@ from django.http.response import (
 from django.shortcuts import render
 from django.utils.datastructures import MultiValueDictKeyError
 
-from snapms.config import AtlasFilter, Parameters
+from snapms.config import GNPS_TABLE_TYPES, AtlasFilter, Parameters
 
 from .models import Job, FileFormat
 from .tasks import run_snapms_gnps, run_snapms_masslist
@@ -140,10 +140,13 @@ def handle_snapms_request(request: HttpRequest) -> HttpResponse:
         job_id=job_id,
         atlas_filter=AtlasFilter(data["reference_db"]),
         custom_filter=data["custom_value"],
+        use_cache=True,
+        workers=settings.SNAPMS_WORKERS,
+        stream_reference_db=True,
     )
     if parameters.file_type == "csv":
         run_snapms_masslist.delay(parameters, job_id)
-    elif parameters.file_type == "graphml":
+    elif parameters.file_type == "graphml" or parameters.file_type in GNPS_TABLE_TYPES:
         parameters.compress_output = True
         run_snapms_gnps.delay(parameters, job_id)
     elif parameters.file_type == "cys":